@@ -0,0 +1,130 @@
+"""
+This script calculates how often the quarterly change codes of any number of financial metrics agree,
+and stores the agreement matrix of every company in a PostgreSQL database.
+
+correlation.py compares the fixed trio revenue, market_cap and roic. This script takes an arbitrary
+list of metrics from `data->'financials'->'quarterly'` (e.g. eps, fcf, margins) and computes, in one
+vectorized pass over all companies:
+    - the agreement ratio of every pair of metrics (the share of quarters in which both codes are equal),
+    - the all-way agreement ratio (the share of quarters in which all codes are equal).
+The codes and ratios follow correlation.py: quarters are compared up to the shortest series and
+divided by the length of the first metric of the pair. With `--metrics revenue roic market_cap` the
+pairs reproduce correlation_rev_roic, correlation_rev_cap and correlation_roic_cap of company_correlation.
+
+Environment Variables:
+    - POSTGRES_USER, POSTGRES_PASSWORD, POSTGRES_DB, POSTGRES_HOST, POSTGRES_PORT
+    - UPSERT_BATCH_SIZE: Rows per INSERT statement (default: 1000).
+
+Functions:
+    - fetch_metrics(metrics): Fetches the symbol and the quarterly series of the metrics of every company.
+    - calculate_agreement(df, metrics): Returns the pairwise and all-way agreement of every company.
+    - main(metrics, batch_size): Calculates the agreement for the metrics and stores it.
+
+Database Schema:
+    - Table: company_agreement
+        - metric_set (TEXT): Comma-separated list of the metrics, in the order given.
+        - symbol (TEXT): Company symbol; (metric_set, symbol) is the primary key.
+        - pairwise (REAL[]): Upper triangle of the agreement matrix, row by row:
+          (m1, m2), (m1, m3), ..., (m2, m3), ... for metrics m1, m2, m3, ...
+        - agreement_all (REAL): Share of quarters in which the codes of all metrics agree.
+
+Usage:
+    python agreement.py --metrics revenue market_cap roic eps fcf
+"""
+import argparse
+import re
+
+import psycopg2
+import pandas as pd
+
+from correlation import (POSTGRES_DB, POSTGRES_HOST, POSTGRES_PASSWORD, POSTGRES_PORT, POSTGRES_USER,
+                         agreement_pairs, agreement_ratio, change_codes, stack_metrics)
+from bulk import DEFAULT_BATCH_SIZE, upsert_rows
+
+METRIC_PATTERN = re.compile(r'^[A-Za-z0-9_]+$')
+
+
+# Function to connect to PostgreSQL
+def get_db_connection():
+    return psycopg2.connect(
+        dbname=POSTGRES_DB,
+        user=POSTGRES_USER,
+        password=POSTGRES_PASSWORD,
+        host=POSTGRES_HOST,
+        port=POSTGRES_PORT
+    )
+
+
+# Function to fetch the quarterly series of the metrics, one row per symbol (the last one, like correlation.py)
+# The metric names are passed as query parameters; missing series become empty arrays
+def fetch_metrics(metrics):
+    columns = ",\n".join(
+        f"jsonb_to_float8_array(data->'financials'->'quarterly'->%s) AS m{i}" for i in range(len(metrics))
+    )
+    query = f"""
+        SELECT DISTINCT ON (symbol) symbol,
+            {columns}
+        FROM companies
+        WHERE symbol IS NOT NULL
+        ORDER BY symbol, id DESC;
+    """
+    conn = get_db_connection()
+    try:
+        df = pd.read_sql(query, conn, params=tuple(metrics))
+    finally:
+        conn.close()
+    df.columns = ['symbol', *metrics]
+    return df
+
+
+# Function to calculate the agreement matrix of every company
+# Returns a DataFrame with symbol, pairwise (list of ratios in np.triu_indices order) and agreement_all
+def calculate_agreement(df, metrics):
+    values, lengths = stack_metrics([df[metric].tolist() for metric in metrics])
+    codes = change_codes(values, first=-1)
+    results = pd.DataFrame({'symbol': df['symbol'].to_numpy()})
+    results['pairwise'] = agreement_pairs(codes, lengths).tolist()
+    results['agreement_all'] = agreement_ratio(codes, lengths)
+    return results
+
+
+# Main function
+def main(metrics, batch_size=DEFAULT_BATCH_SIZE):
+    for metric in metrics:
+        if not METRIC_PATTERN.match(metric):
+            raise ValueError(f"Invalid metric name: {metric}")
+    if len(metrics) < 2:
+        raise ValueError("At least two metrics are needed for an agreement matrix")
+
+    df = fetch_metrics(metrics)
+    results = calculate_agreement(df, metrics)
+    metric_set = ",".join(metrics)
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS company_agreement (
+            metric_set TEXT,
+            symbol TEXT,
+            pairwise REAL[],
+            agreement_all REAL,
+            PRIMARY KEY (metric_set, symbol)
+        );
+    """)
+    upsert_rows(cursor, 'company_agreement', ['metric_set', 'symbol', 'pairwise', 'agreement_all'],
+                ((metric_set, row['symbol'], row['pairwise'], row['agreement_all'])
+                 for row in results.to_dict(orient='records')),
+                key_columns=('metric_set', 'symbol'), batch_size=batch_size)
+    conn.commit()
+    cursor.close()
+    conn.close()
+    print(f"Stored the agreement of {len(results)} companies for {metric_set}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calculate the agreement matrix of quarterly metrics")
+    parser.add_argument("--metrics", nargs="+", default=['revenue', 'market_cap', 'roic'],
+                        help="Metrics under data->'financials'->'quarterly'")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Rows per INSERT statement")
+    args = parser.parse_args()
+    main(args.metrics, args.batch_size)
@@ -0,0 +1,194 @@
+"""
+This script checks the vectorized correlation engine in correlation.py against the original
+per-company loops (`calculate_codes`, the four `calculate_correlation_*` functions and
+`calculate_consecutive_ones`) and times both on a synthetic universe.
+
+The metrics of one company get different lengths now and then, to exercise the ragged-length
+masking, and the series include zeros and negative values. The script exits with an error when
+any row differs from the loop result.
+
+Usage:
+    python benchmark_correlation.py --companies 50000 --quarters 65
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from correlation import calculate_correlations, correlation_arrays, stack_metrics
+
+
+# Original loop implementation from correlation.py (before classify.py)
+def loop_calculate_codes(data):
+    codes = []
+    for i in range(len(data)):
+        if i == 0:  # No previous value for the first item
+            code = -1
+        else:
+            if data[i - 1] == 0:
+                change = 0
+            else:
+                change = (data[i] - data[i - 1]) / data[i - 1] * 100  # Percentage change
+            if data[i] < 0:
+                change = -100  # Negative change
+            if change > 0:
+                code = 1  # Positive change
+            elif -7 <= change <= 0:
+                code = 0  # Small negative or no change
+            elif change < -7:
+                code = -1  # Large negative change
+        codes.append(code)
+    return codes
+
+
+def calculate_correlation_all(revenue, market_cap, roic):
+    correlation = 0
+    for r, m, ro in zip(revenue, market_cap, roic):
+        if r == 1 and ro == 1 and m == 1:
+            correlation += 1
+        elif r == -1 and ro == -1 and m == -1:
+            correlation += 1
+        elif r == 0 and ro == 0 and m == 0:
+            correlation += 1
+    return correlation / len(revenue) if revenue else 0
+
+
+def calculate_correlation_rev_roic(revenue, roic):
+    correlation = 0
+    for r, ro in zip(revenue, roic):
+        if r == 1 and ro == 1:
+            correlation += 1
+        elif r == -1 and ro == -1:
+            correlation += 1
+        elif r == 0 and ro == 0:
+            correlation += 1
+    return correlation / len(revenue) if revenue else 0
+
+
+def calculate_correlation_rev_cap(revenue, market_cap):
+    correlation = 0
+    for r, m in zip(revenue, market_cap):
+        if r == 1 and m == 1:
+            correlation += 1
+        elif r == -1 and m == -1:
+            correlation += 1
+        elif r == 0 and m == 0:
+            correlation += 1
+    return correlation / len(revenue) if revenue else 0
+
+
+def calculate_correlation_roic_cap(roic, market_cap):
+    correlation = 0
+    for ro, m in zip(roic, market_cap):
+        if ro == 1 and m == 1:
+            correlation += 1
+        elif ro == -1 and m == -1:
+            correlation += 1
+        elif ro == 0 and m == 0:
+            correlation += 1
+    return correlation / len(roic) if roic else 0
+
+
+def calculate_consecutive_ones(data):
+    max_consecutive = 0
+    current_streak = 0
+    for value in data:
+        if value == 1:
+            current_streak += 1
+            if current_streak > 2:
+                max_consecutive += 1
+        else:
+            current_streak = 0
+    return max_consecutive
+
+
+# Original main loop of correlation.py
+def loop_correlations(df):
+    results = []
+    for _, row in df.iterrows():
+        revenue = loop_calculate_codes(row['revenue'])
+        market_cap = loop_calculate_codes(row['market_cap'])
+        roic = loop_calculate_codes(row['roic'])
+        results.append({
+            'symbol': row['symbol'],
+            'revenue': revenue,
+            'market_cap': market_cap,
+            'roic': roic,
+            'correlation_all': calculate_correlation_all(revenue, market_cap, roic),
+            'correlation_rev_roic': calculate_correlation_rev_roic(revenue, roic),
+            'correlation_rev_cap': calculate_correlation_rev_cap(revenue, market_cap),
+            'correlation_roic_cap': calculate_correlation_roic_cap(roic, market_cap),
+            'consecutive_ones': calculate_consecutive_ones(market_cap)
+        })
+    return results
+
+
+def synthetic_series(rng, length, start):
+    values = start * np.cumprod(1 + rng.normal(0.01, 0.08, length))
+    values[rng.random(length) < 0.03] = 0  # Quarters without data
+    values[rng.random(length) < 0.02] *= -1  # Losses
+    return values.tolist()
+
+
+def synthetic_universe(n_companies, n_quarters, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = []
+    for i in range(n_companies):
+        length = int(rng.integers(0, n_quarters + 1))
+        # Now and then the metrics of one company have different lengths
+        lengths = [length if rng.random() < 0.9 else int(rng.integers(0, n_quarters + 1)) for _ in range(3)]
+        rows.append({
+            'symbol': f"SYN{i}:DE",
+            'revenue': synthetic_series(rng, lengths[0], 1e8),
+            'market_cap': synthetic_series(rng, lengths[1], 1e9),
+            'roic': synthetic_series(rng, lengths[2], 0.1),
+        })
+    return pd.DataFrame(rows)
+
+
+def main(n_companies, n_quarters):
+    df = synthetic_universe(n_companies, n_quarters)
+
+    start = time.perf_counter()
+    expected = loop_correlations(df)
+    loop_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    computed = calculate_correlations(df)
+    engine_time = time.perf_counter() - start
+
+    # The same work split up: padding the lists, the array computation itself
+    start = time.perf_counter()
+    values, lengths = stack_metrics([df['revenue'].tolist(), df['market_cap'].tolist(), df['roic'].tolist()])
+    stack_time = time.perf_counter() - start
+    start = time.perf_counter()
+    correlation_arrays(values, lengths)
+    arrays_time = time.perf_counter() - start
+    records = computed.to_dict(orient='records')
+
+    mismatches = 0
+    for row, expected_row in zip(records, expected):
+        if row != expected_row:
+            mismatches += 1
+            if mismatches <= 5:
+                print(f"mismatch for {expected_row['symbol']}: {row} != {expected_row}")
+
+    print(f"{n_companies} companies x up to {n_quarters} quarters")
+    print(f"loop:       {loop_time:.3f}s")
+    print(f"vectorized: {engine_time:.3f}s -> {loop_time / engine_time:.0f}x faster than the loop")
+    print(f"  padding:  {stack_time:.3f}s")
+    print(f"  arrays:   {arrays_time:.3f}s -> {loop_time / arrays_time:.0f}x faster than the loop")
+    print("  the rest converts the code arrays back to one Python list per company")
+    if mismatches or len(records) != len(expected):
+        raise SystemExit(f"{mismatches} rows differ")
+    print("all rows identical")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check and benchmark the vectorized correlation engine")
+    parser.add_argument("--companies", type=int, default=50000, help="Number of synthetic companies")
+    parser.add_argument("--quarters", type=int, default=65, help="Maximum number of quarters per company")
+    args = parser.parse_args()
+    main(args.companies, args.quarters)
@@ -14,17 +14,31 @@ Environment Variables:
     - POSTGRES_DB: PostgreSQL database name (default: 'mydatabase').
     - POSTGRES_HOST: PostgreSQL host (default: 'localhost').
     - POSTGRES_PORT: PostgreSQL port (default: '5432').
+    - UPSERT_BATCH_SIZE: Rows per INSERT statement (default: 1000).
 
 Functions:
     - fetch_data(query): Fetches data from the PostgreSQL database based on the provided SQL query.
-    - calculate_codes(data): Calculates codes based on percentage changes in the data.
+    - change_codes(values): Calculates codes based on percentage changes in the data (ana_report/classify.py).
         - Code 1: Positive change.
         - Code 0: Small negative or no change (-7% to 0%).
         - Code -1: Large negative change (less than -7%).
-    - calculate_correlation(revenue, market_cap, roic): Calculates the correlation between revenue, market cap, and ROIC codes.
-        - Correlation is incremented when all three codes are either 1 or -1.
-    - calculate_consecutive_ones(data): Calculates the number of periods with more than two consecutive code 1 values.
-    - main(): Main function that fetches data, processes it, and stores the results in a PostgreSQL table.
+    - stack_metrics(metrics): Stacks the ragged series of all companies into one NaN padded array plus lengths.
+    - agreement_ratio(codes, lengths): Calculates the correlation between the codes of two or more metrics.
+        - Correlation is incremented when the codes of all metrics are equal (all 1, all 0 or all -1).
+    - agreement_pairs(codes, lengths): Calculates the agreement ratio of every pair of an arbitrary list of metrics.
+    - consecutive_ones(codes, lengths): Calculates the number of periods with more than two consecutive code 1 values.
+    - correlation_arrays(values, lengths): Calculates codes, the four correlations and streaks on padded arrays.
+    - unpad(values, lengths): Splits a padded matrix back into one list per company.
+    - calculate_correlations(df): Calculates codes, correlations and streaks of all companies in one vectorized
+      pass; the arrays are masked beyond each series' length, so ragged series give the same results as the
+      former per-company loops (see benchmark_correlation.py).
+    - create_correlation_table(cursor): Creates the company_correlation table.
+    - main(batch_size, full): Main function that fetches data, processes it, and stores the results in a PostgreSQL
+      table with bulk upserts of batch_size rows (ana_report/bulk.py). Only companies whose quarterly series
+      changed since the last run are fetched and recomputed, unless full is set.
+      With chunk_size, companies are read through a server-side cursor in chunks that are computed
+      by a pool of `workers` processes (stream_chunks, map_chunks, result_rows); memory use is bounded
+      by a few chunks and progress and throughput are printed after every chunk.
 
 Database Schema:
     - Table: company_correlation
@@ -34,17 +48,32 @@ Database Schema:
         - roic (INTEGER[]): Array of calculated ROIC codes.
         - correlation (FLOAT): Correlation value between revenue, market cap, and ROIC.
         - consecutive_ones (INT): Number of periods with more than two consecutive code 1 values.
+        - source_hash (TEXT): companies.quarterly_hash of the series the row was computed from
+          (postgres/migrations/005_quarterly_hash.sql); rows whose hash still matches are skipped.
 
 Usage:
     - Ensure the required environment variables are set in a .env file.
     - Run the script to calculate financial correlations and store the results in the database.
+    - python correlation.py            # changed companies only (nightly delta job)
+    - python correlation.py --full     # recompute every company
+    - python correlation.py --full --chunk-size 5000 --workers 4   # universes that do not fit in memory
 """
+import argparse
 import psycopg2
 import pandas as pd
 from dotenv import load_dotenv
 import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 
+# The code classification is shared with the ana_report service
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ana_report'))
+from classify import change_codes, pad_series
+from bulk import DEFAULT_BATCH_SIZE, upsert_rows
+
 # Load environment variables
 load_dotenv()
 
@@ -54,6 +83,9 @@ POSTGRES_DB = os.getenv('POSTGRES_DB', 'mydatabase')
 POSTGRES_HOST = os.getenv('POSTGRES_HOST', 'localhost')
 POSTGRES_PORT = os.getenv('POSTGRES_PORT', '5432')
 
+RESULT_COLUMNS = ['symbol', 'revenue', 'market_cap', 'roic', 'correlation_all', 'correlation_rev_roic',
+                  'correlation_rev_cap', 'correlation_roic_cap', 'consecutive_ones', 'source_hash']
+
 # Function to fetch data from PostgreSQL
 def fetch_data(query):
     conn = psycopg2.connect(
@@ -67,138 +99,86 @@ def fetch_data(query):
     conn.close()
     return df
 
-# Function to calculate codes based on percentage changes
-def calculate_codes(data):
-    codes = []
-    for i in range(len(data)):
-        if i == 0:  # No previous value for the first item
-            code = -1
-        else:
-            if data[i - 1] == 0:
-                change = 0
-            else:
-                change = (data[i] - data[i - 1]) / data[i - 1] * 100  # Percentage change
-            if data[i] < 0:
-                change = -100  # Negative change
-            if change > 0:
-                code = 1  # Positive change
-            elif -7 <= change <= 0:
-                code = 0  # Small negative or no change
-            elif change < -7:
-                code = -1  # Large negative change
-        codes.append(code)
-    return codes
-
-# Function to calculate correlation between revenue, market_cap, and roic
-def calculate_correlation_all(revenue, market_cap, roic):
-    correlation = 0
-    for r, m, ro in zip(revenue, market_cap, roic):
-        if r == 1 and ro == 1 and m == 1:
-            correlation += 1
-        elif r == -1 and ro == -1 and m == -1:
-            correlation += 1
-        elif r == 0 and ro == 0 and m == 0:
-            correlation += 1    
-    return correlation / len(revenue) if revenue else 0
-
-# Function to calculate correlation between revenue and roic
-def calculate_correlation_rev_roic(revenue, roic):
-    correlation = 0
-    for r, ro in zip(revenue, roic):
-        if r == 1 and ro == 1:
-            correlation += 1
-        elif r == -1 and ro == -1:
-            correlation += 1
-        elif r == 0 and ro == 0:
-            correlation += 1
-    return correlation / len(revenue) if revenue else 0
-
-# Function to calculate correlation between revenue and market_cap
-def calculate_correlation_rev_cap(revenue, market_cap):
-    correlation = 0
-    for r, m in zip(revenue, market_cap):
-        if r == 1 and m == 1:
-            correlation += 1
-        elif r == -1 and m == -1:
-            correlation += 1
-        elif r == 0 and m == 0:
-            correlation += 1
-    return correlation / len(revenue) if revenue else 0
-
-# Function to calculate correlation between roic and market_cap
-def calculate_correlation_roic_cap(roic, market_cap):
-    correlation = 0
-    for ro, m in zip(roic, market_cap):
-        if ro == 1 and m == 1:
-            correlation += 1
-        elif ro == -1 and m == -1:
-            correlation += 1
-        elif ro == 0 and m == 0:
-            correlation += 1
-    return correlation / len(roic) if roic else 0
-
-# Function to calculate consecutive periods of code 1
-def calculate_consecutive_ones(data):
-    max_consecutive = 0
-    current_streak = 0
-    for value in data:
-        if value == 1:
-            current_streak += 1
-            if current_streak > 2:
-                max_consecutive += 1
-        else:
-            current_streak = 0
-    return max_consecutive
+# Function to stack the series of several metrics into one NaN padded array
+# Returns values (metrics x companies x quarters) and lengths (metrics x companies)
+def stack_metrics(metrics):
+    padded = [pad_series(series) for series in metrics]
+    width = max((values.shape[1] for values, _ in padded), default=0)
+    n_companies = len(metrics[0]) if metrics else 0
+    values = np.full((len(padded), n_companies, width), np.nan)
+    for k, (metric_values, _) in enumerate(padded):
+        values[k, :, :metric_values.shape[1]] = metric_values
+    lengths = np.stack([metric_lengths for _, metric_lengths in padded]) if padded else np.zeros((0, 0), dtype=np.int64)
+    return values, lengths
 
-# Main function
-def main():
-    query = """
-        SELECT 
-            data->>'qfs_symbol_v2' AS symbol,
-            data->'financials'->'quarterly'->'revenue' AS revenue,
-            data->'financials'->'quarterly'->'market_cap' AS market_cap,
-            data->'financials'->'quarterly'->'roic' AS roic
-        FROM companies;
-    """
-    
-    df = fetch_data(query)
-    
-    # Prepare the new table data
-    results = []
-    for _, row in df.iterrows():
-        revenue = calculate_codes(row['revenue'])
-        market_cap = calculate_codes(row['market_cap'])
-        roic = calculate_codes(row['roic'])
-        
-        correlation_all = calculate_correlation_all(revenue, market_cap, roic)
-        correlation_rev_roic = calculate_correlation_rev_roic(revenue, roic)
-        correlation_rev_cap = calculate_correlation_rev_cap(revenue, market_cap)
-        correlation_roic_cap = calculate_correlation_roic_cap(roic, market_cap)
-        consecutive_ones = calculate_consecutive_ones(market_cap)
-        
-        results.append({
-            'symbol': row['symbol'],
-            'revenue': revenue,
-            'market_cap': market_cap,
-            'roic': roic,
-            'correlation_all': correlation_all,
-            'correlation_rev_roic': correlation_rev_roic,
-            'correlation_rev_cap': correlation_rev_cap,
-            'correlation_roic_cap': correlation_roic_cap,
-            'consecutive_ones': consecutive_ones
-        })
-    
-    # Create a new PostgreSQL table and insert the results
-    conn = psycopg2.connect(
-        dbname=POSTGRES_DB,
-        user=POSTGRES_USER,
-        password=POSTGRES_PASSWORD,
-        host=POSTGRES_HOST,
-        port=POSTGRES_PORT
-    )
-    cursor = conn.cursor()
-    
-    # Create the new table
+# Function to calculate the share of quarters in which the codes of all given metrics agree
+# codes: metrics x companies x quarters, lengths: metrics x companies
+# Quarters are compared up to the shortest series and divided by the length of the first metric,
+# a company whose first metric is empty gets 0
+def agreement_ratio(codes, lengths):
+    width = codes.shape[-1]
+    common = lengths.min(axis=0)
+    within = np.arange(width)[np.newaxis, :] < common[:, np.newaxis]
+    agree = within & np.all(codes == codes[:1], axis=0)
+    matches = agree.sum(axis=1)
+    denominator = lengths[0]
+    return np.divide(matches, denominator, out=np.zeros(len(matches)), where=denominator > 0)
+
+# Function to calculate the pairwise agreement ratios of any number of metrics in one pass
+# codes: metrics x companies x quarters, lengths: metrics x companies
+# Returns companies x pairs, the pairs (i, j) with i < j in the order of np.triu_indices;
+# like agreement_ratio, each pair is divided by the length of its first metric
+def agreement_pairs(codes, lengths):
+    first, second = np.triu_indices(codes.shape[0], 1)
+    common = np.minimum(lengths[first], lengths[second])
+    within = np.arange(codes.shape[-1]) < common[..., np.newaxis]
+    matches = ((codes[first] == codes[second]) & within).sum(axis=-1)
+    denominator = lengths[first]
+    ratios = np.divide(matches, denominator, out=np.zeros(matches.shape), where=denominator > 0)
+    return ratios.T
+
+# Function to count the quarters that extend a streak of code 1 beyond two quarters
+# codes: companies x quarters, lengths: companies
+def consecutive_ones(codes, lengths):
+    ones = (codes == 1) & (np.arange(codes.shape[-1])[np.newaxis, :] < lengths[:, np.newaxis])
+    return (ones[:, 2:] & ones[:, 1:-1] & ones[:, :-2]).sum(axis=1)
+
+# Function to split a padded matrix back into one list per row
+def unpad(values, lengths):
+    within = np.arange(values.shape[-1])[np.newaxis, :] < lengths[:, np.newaxis]
+    flat = values[within].tolist()
+    ends = np.cumsum(lengths).tolist()
+    return [flat[start:end] for start, end in zip([0] + ends[:-1], ends)]
+
+# Function to calculate the codes, correlations and streaks of padded metric arrays
+# values: (revenue, market_cap, roic) x companies x quarters, lengths: metrics x companies
+def correlation_arrays(values, lengths):
+    revenue, market_cap, roic = 0, 1, 2
+    codes = change_codes(values, first=-1)
+    return codes, {
+        'correlation_all': agreement_ratio(codes, lengths),
+        'correlation_rev_roic': agreement_ratio(codes[[revenue, roic]], lengths[[revenue, roic]]),
+        'correlation_rev_cap': agreement_ratio(codes[[revenue, market_cap]], lengths[[revenue, market_cap]]),
+        'correlation_roic_cap': agreement_ratio(codes[[roic, market_cap]], lengths[[roic, market_cap]]),
+        'consecutive_ones': consecutive_ones(codes[market_cap], lengths[market_cap]),
+    }
+
+# Function to calculate the codes, correlations and streaks of many companies at once
+# Returns a DataFrame with the columns of the company_correlation table
+def calculate_correlations(df):
+    values, lengths = stack_metrics([df['revenue'].tolist(), df['market_cap'].tolist(), df['roic'].tolist()])
+    codes, columns = correlation_arrays(values, lengths)
+
+    results = pd.DataFrame({'symbol': df['symbol'].to_numpy()})
+    for k, name in enumerate(('revenue', 'market_cap', 'roic')):
+        results[name] = unpad(codes[k], lengths[k])
+    for name, column in columns.items():
+        results[name] = column
+    return results
+
+# Function to create the result table; source_hash records the companies.quarterly_hash
+# the row was computed from
+def create_correlation_table(cursor):
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS company_correlation (
             symbol TEXT PRIMARY KEY,
@@ -212,37 +192,125 @@ def main():
             consecutive_ones INT
         );
     """)
+    cursor.execute("ALTER TABLE company_correlation ADD COLUMN IF NOT EXISTS source_hash TEXT;")
+
+# Function to calculate the table rows of a batch of companies, in RESULT_COLUMNS order
+# Runs in the worker processes in chunked mode
+def result_rows(df):
+    results = calculate_correlations(df)
+    results['source_hash'] = df['quarterly_hash'].to_numpy()
+    results = results.to_dict(orient='records')
+    return [[result[column] for column in RESULT_COLUMNS] for result in results]
+
+# Function to read the query result in DataFrames of chunk_size rows through a server-side cursor
+def stream_chunks(query, chunk_size):
+    conn = psycopg2.connect(
+        dbname=POSTGRES_DB,
+        user=POSTGRES_USER,
+        password=POSTGRES_PASSWORD,
+        host=POSTGRES_HOST,
+        port=POSTGRES_PORT
+    )
+    try:
+        with conn.cursor(name='correlation_chunks') as cursor:
+            cursor.itersize = chunk_size
+            cursor.execute(query)
+            columns = None
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                if columns is None:
+                    columns = [column.name for column in cursor.description]
+                yield pd.DataFrame(rows, columns=columns)
+    finally:
+        conn.close()
+
+# Function to calculate the rows of every chunk over a process pool, in order
+# At most two chunks per worker are in flight, so memory stays bounded; workers=0 runs in this process
+def map_chunks(chunks, workers=None):
+    if workers == 0:
+        for chunk in chunks:
+            yield len(chunk), result_rows(chunk)
+        return
+    window = 2 * (workers or os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append((len(chunk), executor.submit(result_rows, chunk)))
+            if len(pending) >= window:
+                size, future = pending.popleft()
+                yield size, future.result()
+        while pending:
+            size, future = pending.popleft()
+            yield size, future.result()
+
+# Main function
+# Only companies whose quarterly series changed since the last run are recomputed, full=True recomputes all
+# chunk_size reads and processes the companies in chunks over `workers` processes instead of all at once
+def main(batch_size=DEFAULT_BATCH_SIZE, full=False, chunk_size=None, workers=None):
+    conn = psycopg2.connect(
+        dbname=POSTGRES_DB,
+        user=POSTGRES_USER,
+        password=POSTGRES_PASSWORD,
+        host=POSTGRES_HOST,
+        port=POSTGRES_PORT
+    )
+    cursor = conn.cursor()
     
-    # Insert the results into the table
-    for result in results:
-        cursor.execute("""
-            INSERT INTO company_correlation (
-                symbol, revenue, market_cap, roic, correlation_all, correlation_rev_roic, correlation_rev_cap, correlation_roic_cap, consecutive_ones)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-            ON CONFLICT (symbol) DO UPDATE
-            SET revenue = EXCLUDED.revenue,
-                market_cap = EXCLUDED.market_cap,
-                roic = EXCLUDED.roic,
-                correlation_all = EXCLUDED.correlation_all,
-                correlation_rev_roic = EXCLUDED.correlation_rev_roic,
-                correlation_rev_cap = EXCLUDED.correlation_rev_cap,
-                correlation_roic_cap = EXCLUDED.correlation_roic_cap,
-                consecutive_ones = EXCLUDED.consecutive_ones;
-        """, (
-            result['symbol'],
-            result['revenue'],
-            result['market_cap'],
-            result['roic'],
-            result['correlation_all'],
-            result['correlation_rev_roic'],
-            result['correlation_rev_cap'],
-            result['correlation_roic_cap'],
-            result['consecutive_ones']
-        ))
-    
+    # Create the new table
+    create_correlation_table(cursor)
     conn.commit()
+
+    # One row per symbol, the last one like the former per-row upserts; the hash comparison
+    # runs in PostgreSQL, so unchanged companies never leave the database
+    query = """
+        SELECT symbol, revenue, market_cap, roic, quarterly_hash
+        FROM (
+            SELECT DISTINCT ON (symbol) symbol, revenue, market_cap, roic, quarterly_hash
+            FROM companies
+            WHERE symbol IS NOT NULL
+            ORDER BY symbol, id DESC
+        ) AS latest
+    """
+    if not full:
+        query += """
+        WHERE NOT EXISTS (
+            SELECT 1 FROM company_correlation cc
+            WHERE cc.symbol = latest.symbol AND cc.source_hash = latest.quarterly_hash
+        )
+        """
+    mode = 'full' if full else 'changed since the last run'
+
+    if chunk_size:
+        # Every chunk is committed when written, an interrupted run resumes with the remaining companies
+        start = time.perf_counter()
+        done = 0
+        for size, rows in map_chunks(stream_chunks(query, chunk_size), workers):
+            upsert_rows(cursor, 'company_correlation', RESULT_COLUMNS, rows, batch_size=batch_size)
+            conn.commit()
+            done += size
+            elapsed = time.perf_counter() - start
+            print(f"{done} companies recomputed ({mode}), {done / elapsed:.0f} companies/s")
+    else:
+        df = fetch_data(query)
+        print(f"{len(df)} companies to recompute ({mode})")
+
+        # Prepare the new table data, all companies in one vectorized pass
+        # Insert the results into the table, batch_size rows per statement
+        upsert_rows(cursor, 'company_correlation', RESULT_COLUMNS, result_rows(df), batch_size=batch_size)
+        conn.commit()
+    
     cursor.close()
     conn.close()
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Calculate the company correlations")
+    parser.add_argument("--full", action="store_true", help="Recompute every company, not only changed ones")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Rows per INSERT statement")
+    parser.add_argument("--chunk-size", type=int, default=None,
+                        help="Read and process the companies in chunks of this many rows (default: all at once)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Processes computing chunks (default: number of CPUs, 0: no pool)")
+    args = parser.parse_args()
+    main(args.batch_size, full=args.full, chunk_size=args.chunk_size, workers=args.workers)
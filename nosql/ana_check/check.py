@@ -3,6 +3,12 @@ import psycopg2
 from psycopg2.extras import Json
 import json
 from urllib.parse import quote
+import os
+import sys
+
+# The bulk upsert is shared with the other batch writers, see ana_report/bulk.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ana_report'))
+from bulk import upsert_rows
 
 # Configuration
 DATA_ENDPOINT = "http://localhost:8001/data"
@@ -14,6 +20,7 @@ DB_CONFIG = {
     "host": "localhost",
     "port": "5432"
 }
+STORE_EVERY = 100
 
 # Initialize PostgreSQL table
 def init_db():
@@ -57,24 +64,23 @@ def check_pattern(symbol):
         print(f"Error checking pattern for {symbol}: {e}")
         return {"symbol": symbol, "pattern_detected": False}
 
-# Store result in PostgreSQL
-def store_result(symbol, pattern_data):
+# Store results in PostgreSQL, results is a list of (symbol, pattern_data) pairs
+def store_results(results):
+    if not results:
+        return
+    conn = None
     try:
         conn = psycopg2.connect(**DB_CONFIG)
-        cursor = conn.cursor()
-        # Upsert the pattern data
-        cursor.execute("""
-            INSERT INTO symbol_patterns (symbol, pattern_data)
-            VALUES (%s, %s)
-            ON CONFLICT (symbol)
-            DO UPDATE SET pattern_data = EXCLUDED.pattern_data;
-        """, (symbol, Json(pattern_data)))
+        with conn.cursor() as cursor:
+            # Upsert the pattern data, one statement per batch instead of one per symbol
+            upsert_rows(cursor, 'symbol_patterns', ['symbol', 'pattern_data'],
+                        ((symbol, Json(pattern_data)) for symbol, pattern_data in results))
         conn.commit()
     except Exception as e:
-        print(f"Error storing result for {symbol}: {e}")
+        print(f"Error storing results, not stored: {', '.join(symbol for symbol, _ in results)}: {e}")
     finally:
-        cursor.close()
-        conn.close()
+        if conn is not None:
+            conn.close()
 
 def main():
     # Initialize database
@@ -84,12 +90,20 @@ def main():
     symbols = fetch_symbols()
     print(f"Found {len(symbols)} symbols to process.")
     
-    # Process each symbol
-    for symbol in symbols:
-        print(f"Processing {symbol}...")
-        pattern_data = check_pattern(symbol)
-        store_result(symbol, pattern_data)
-        print(f"Stored result for {symbol}")
+    # Process each symbol, storing the results every STORE_EVERY symbols
+    # Whatever is still pending is flushed in finally, also when the loop is interrupted
+    results = []
+    try:
+        for symbol in symbols:
+            print(f"Processing {symbol}...")
+            pattern_data = check_pattern(symbol)
+            results.append((symbol, pattern_data))
+            if len(results) >= STORE_EVERY:
+                store_results(results)
+                print(f"Stored results up to {symbol}")
+                results = []
+    finally:
+        store_results(results)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,120 @@
+"""
+This script checks the vectorized classification in classify.py against the original Python loop
+implementations (`get_item_color` in fastapp.py/report.py and `calculate_codes` in
+advisor/correlation.py) and times both on a synthetic universe.
+
+The series include zeros, negative values and ragged lengths, to exercise every branch of the
+-7% threshold rules. The script exits with an error when any series is classified differently.
+
+Usage:
+    python benchmark_classify.py --companies 50000 --quarters 65
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from classify import calculate_codes, change_codes, item_colors, pad_series
+
+
+# Original loop implementation from fastapp.py / report.py
+def loop_item_color(data):
+    colors = []
+    for i in range(len(data)):
+        if i == 0:  # No previous value for the first item
+            colors.append('blue')  # Default color for the first item
+        else:
+            if data[i - 1] == 0:
+                change = 0
+            else:
+                change = (data[i] - data[i - 1]) / data[i - 1] * 100  # Percentage change
+            if data[i] < 0:
+                change = -100  # Negative change
+            if change > 0:
+                colors.append('green')  # Positive change
+            elif -7 <= change <= 0:
+                colors.append('orange')  # Small negative or no change
+            elif change < -7:
+                colors.append('red')  # Large negative change
+    return colors
+
+
+# Original loop implementation from advisor/correlation.py
+def loop_calculate_codes(data):
+    codes = []
+    for i in range(len(data)):
+        if i == 0:  # No previous value for the first item
+            code = -1
+        else:
+            if data[i - 1] == 0:
+                change = 0
+            else:
+                change = (data[i] - data[i - 1]) / data[i - 1] * 100  # Percentage change
+            if data[i] < 0:
+                change = -100  # Negative change
+            if change > 0:
+                code = 1  # Positive change
+            elif -7 <= change <= 0:
+                code = 0  # Small negative or no change
+            elif change < -7:
+                code = -1  # Large negative change
+        codes.append(code)
+    return codes
+
+
+def synthetic_universe(n_companies, n_quarters, seed=0):
+    rng = np.random.default_rng(seed)
+    universe = []
+    for _ in range(n_companies):
+        length = int(rng.integers(0, n_quarters + 1))
+        values = rng.uniform(1e6, 1e9) * np.cumprod(1 + rng.normal(0.0, 0.08, length))
+        values[rng.random(length) < 0.03] = 0  # Quarters without data
+        values[rng.random(length) < 0.02] *= -1  # Losses
+        # Exact -7% and 0% steps hit the threshold boundaries
+        for i in np.flatnonzero(rng.random(length) < 0.02):
+            if i > 0:
+                values[i] = values[i - 1] * rng.choice([0.93, 1.0])
+        # JSON arrays hold Python ints for revenue/market_cap and floats for roic
+        universe.append([int(v) for v in values] if rng.random() < 0.5 else values.tolist())
+    return universe
+
+
+def main(n_companies, n_quarters):
+    universe = synthetic_universe(n_companies, n_quarters)
+
+    loop_colors = [loop_item_color(series) for series in universe]
+    start = time.perf_counter()
+    loop_codes = [loop_calculate_codes(series) for series in universe]
+    loop_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    values, lengths = pad_series(universe)
+    pad_time = time.perf_counter() - start
+    start = time.perf_counter()
+    codes = change_codes(values, first=-1)
+    matrix_time = time.perf_counter() - start
+
+    mismatches = 0
+    for i, series in enumerate(universe):
+        row = codes[i, :lengths[i]].tolist()
+        if row != loop_codes[i] or calculate_codes(series) != loop_codes[i] or item_colors(series) != loop_colors[i]:
+            mismatches += 1
+            if mismatches <= 5:
+                print(f"mismatch for series {i}: {series}")
+
+    print(f"{n_companies} companies x up to {n_quarters} quarters")
+    print(f"loop codes:       {loop_time:.3f}s")
+    print(f"padding:          {pad_time:.3f}s")
+    print(f"vectorized codes: {matrix_time:.3f}s -> {loop_time / matrix_time:.0f}x faster than the loop")
+    if mismatches:
+        raise SystemExit(f"{mismatches} series classified differently")
+    print("all series classified identically")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check and benchmark the vectorized change classification")
+    parser.add_argument("--companies", type=int, default=50000, help="Number of synthetic companies")
+    parser.add_argument("--quarters", type=int, default=65, help="Maximum number of quarters per company")
+    args = parser.parse_args()
+    main(args.companies, args.quarters)
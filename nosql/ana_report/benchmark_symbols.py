@@ -0,0 +1,119 @@
+"""
+This script benchmarks concurrent symbol lookups, comparing the old blocking data path with
+the asyncpg path used by the `/data/{metric}/{symbol}` endpoints in fastapp.py.
+
+- blocking: every lookup opens a psycopg2 connection and runs `pd.read_sql` inside a coroutine,
+  which is what the endpoints did before; the event loop is stalled for each query, so concurrent
+  lookups are serialized.
+- async: lookups run on a shared asyncpg pool, so queries from concurrent coroutines overlap.
+
+Usage:
+    python benchmark_symbols.py --requests 500 --concurrency 100
+"""
+
+import argparse
+import asyncio
+import os
+import time
+
+import pandas as pd
+import psycopg2
+from dotenv import load_dotenv
+
+import db
+
+load_dotenv()
+
+POSTGRES_USER = os.getenv('POSTGRES_USER', 'myuser')
+POSTGRES_PASSWORD = os.getenv('POSTGRES_PASSWORD', 'mypassword')
+POSTGRES_DB = os.getenv('POSTGRES_DB', 'mydatabase')
+POSTGRES_HOST = os.getenv('POSTGRES_HOST', 'localhost')
+POSTGRES_PORT = os.getenv('POSTGRES_PORT', '5432')
+
+QUERY_PSYCOPG2 = """
+    SELECT
+        symbol,
+        COALESCE(data->'financials'->'quarterly'->'market_cap', '[]'::jsonb) AS market_cap
+    FROM companies
+    WHERE symbol = %s;
+"""
+QUERY_ASYNCPG = QUERY_PSYCOPG2.replace('%s', '$1')
+
+
+def get_symbols(limit):
+    conn = psycopg2.connect(
+        user=POSTGRES_USER,
+        password=POSTGRES_PASSWORD,
+        host=POSTGRES_HOST,
+        port=POSTGRES_PORT,
+        database=POSTGRES_DB
+    )
+    cursor = conn.cursor()
+    cursor.execute("SELECT DISTINCT symbol FROM companies WHERE symbol IS NOT NULL LIMIT %s;", (limit,))
+    symbols = [row[0] for row in cursor.fetchall()]
+    cursor.close()
+    conn.close()
+    return symbols
+
+
+async def blocking_lookup(symbol):
+    conn = psycopg2.connect(
+        user=POSTGRES_USER,
+        password=POSTGRES_PASSWORD,
+        host=POSTGRES_HOST,
+        port=POSTGRES_PORT,
+        database=POSTGRES_DB
+    )
+    df = pd.read_sql(QUERY_PSYCOPG2, conn, params=(symbol,))
+    conn.close()
+    return df
+
+
+async def async_lookup(symbol):
+    return await db.fetch_rows(QUERY_ASYNCPG, symbol)
+
+
+async def run(lookup, symbols, total, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with semaphore:
+            await lookup(symbols[i % len(symbols)])
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    return time.perf_counter() - start
+
+
+async def main(total, concurrency, pool_size):
+    symbols = get_symbols(1000)
+    if not symbols:
+        raise SystemExit("No symbols found in the companies table")
+
+    elapsed = await run(blocking_lookup, symbols, total, concurrency)
+    print(f"blocking: {total} lookups in {elapsed:.2f}s -> {total / elapsed:.1f} req/s")
+
+    await db.init_async_pool(
+        pool_size,
+        pool_size,
+        user=POSTGRES_USER,
+        password=POSTGRES_PASSWORD,
+        host=POSTGRES_HOST,
+        port=int(POSTGRES_PORT),
+        database=POSTGRES_DB
+    )
+    try:
+        elapsed = await run(async_lookup, symbols, total, concurrency)
+        print(f"async:    {total} lookups in {elapsed:.2f}s -> {total / elapsed:.1f} req/s")
+        print(f"pool:     {db.async_pool_stats()}")
+    finally:
+        await db.close_async_pool()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark blocking vs asyncpg symbol lookups")
+    parser.add_argument("--requests", type=int, default=500, help="Total number of lookups")
+    parser.add_argument("--concurrency", type=int, default=100, help="Concurrent lookups in flight")
+    parser.add_argument("--pool-size", type=int, default=10, help="asyncpg pool size")
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.concurrency, args.pool_size))
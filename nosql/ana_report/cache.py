@@ -0,0 +1,178 @@
+"""
+This module implements the caches of ana_report: a bounded in-memory response cache for the
+FastAPI app and a content-addressed on-disk cache for the charts of report.py.
+
+Entries are keyed by `(endpoint, symbol, metric)` tuples, expire after a time-to-live and are
+evicted least-recently-used first once the cache holds `maxsize` entries. Quarterly financials
+change rarely, so the symbol and plot endpoints can serve repeated requests from memory.
+Classes:
+- TTLCache(maxsize, ttl): Thread-safe TTL/LRU cache.
+    - get(key): Returns the cached value, or MISSING when absent or expired.
+    - set(key, value): Stores a value, evicting the least recently used entry when full.
+    - invalidate(symbol=None): Drops every entry for a symbol, or everything when symbol is None.
+    - stats(): Returns hit/miss/eviction counters and the current size.
+- DiskLRUCache(directory, max_bytes): Content-addressed file cache, shared by several processes.
+    - key(*parts): Returns the SHA-256 hex digest of the parts (bytes or str).
+    - get(key): Returns the cached bytes, or None when absent; a hit marks the file recently used.
+    - set(key, value): Stores bytes atomically, so concurrent writers never expose partial files.
+    - prune(): Deletes the least recently used files until the cache fits in max_bytes.
+    - stats(): Returns hit/miss/store counters of this process.
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+MISSING = object()
+
+
+class TTLCache:
+    def __init__(self, maxsize=1024, ttl=3600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._invalidations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return MISSING
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self._expirations += 1
+                self._misses += 1
+                return MISSING
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return value
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def invalidate(self, symbol=None):
+        with self._lock:
+            if symbol is None:
+                removed = len(self._entries)
+                self._entries.clear()
+            else:
+                keys = [key for key in self._entries if key[1] == symbol]
+                for key in keys:
+                    del self._entries[key]
+                removed = len(keys)
+            self._invalidations += removed
+            return removed
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.maxsize,
+                "ttl_seconds": self.ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else 0.0,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+                "invalidations": self._invalidations,
+            }
+
+
+class DiskLRUCache:
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._hits = 0
+        self._misses = 0
+        self._stores = 0
+
+    @staticmethod
+    def key(*parts):
+        digest = hashlib.sha256()
+        for part in parts:
+            if isinstance(part, str):
+                part = part.encode()
+            digest.update(len(part).to_bytes(8, 'little'))
+            digest.update(part)
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = f.read()
+            os.utime(path)  # Modification time orders files for LRU eviction
+        except FileNotFoundError:
+            self._misses += 1
+            return None
+        self._hits += 1
+        return value
+
+    def set(self, key, value):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(value)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self._stores += 1
+
+    def prune(self):
+        files = []
+        total = 0
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+        removed = 0
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        return {"files": len(files) - removed, "bytes": total, "evicted": removed}
+
+    def stats(self):
+        lookups = self._hits + self._misses
+        return {
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_rate": round(self._hits / lookups, 4) if lookups else 0.0,
+            "stores": self._stores,
+        }
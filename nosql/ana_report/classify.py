@@ -0,0 +1,71 @@
+"""
+This module classifies quarter-over-quarter changes of financial series with NumPy.
+
+It is the single implementation behind `fastapp.get_item_color`, `report.get_item_color` and
+`advisor/correlation.calculate_codes`. The classification works on a 2-D array
+(companies x quarters), so the whole universe is classified in one array operation.
+Classification of the change from the previous quarter:
+- Code 1: Positive change (green).
+- Code 0: Small negative or no change, -7% to 0% (orange).
+- Code -1: Large negative change, below -7% (red).
+A previous value of 0 counts as no change, and a negative current value counts as -100%.
+The first quarter has no previous value and gets the `first` code.
+Functions:
+- pad_series(series): Stacks ragged series into a NaN padded matrix plus their lengths.
+- change_codes(values, first): Returns the codes for a 1-D or 2-D array.
+- calculate_codes(data): Codes for one series, the first quarter coded -1.
+- item_colors(data): Bar colors for one series, the first quarter colored blue.
+"""
+
+from itertools import chain
+
+import numpy as np
+
+# Percentage drop below which a change is a sell signal (red)
+THRESHOLD = -7
+COLORS = {1: 'green', 0: 'orange', -1: 'red'}
+
+
+def pad_series(series):
+    lengths = np.array([len(s) if s is not None else 0 for s in series], dtype=np.int64)
+    width = int(lengths.max()) if len(lengths) else 0
+    values = np.full((len(lengths), width), np.nan)
+    # One flat array of all values, scattered row by row into the padded matrix
+    flat = np.array(list(chain.from_iterable(s for s in series if s is not None)), dtype=float)
+    values[np.arange(width)[np.newaxis, :] < lengths[:, np.newaxis]] = flat
+    return values, lengths
+
+
+def change_codes(values, first=-1):
+    """
+    Classify every quarter of `values` against the previous quarter.
+    Args:
+        values: 1-D series or 2-D array (companies x quarters); NaN marks padding
+        first: code for the first quarter, which has no previous value
+    Returns:
+        np.ndarray of int8 codes with the shape of `values`; codes next to padding are meaningless
+    """
+    values = np.asarray(values, dtype=float)
+    codes = np.empty(values.shape, dtype=np.int8)
+    if values.shape[-1] == 0:
+        return codes
+    previous = values[..., :-1]
+    current = values[..., 1:]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        change = np.where(previous == 0, 0.0, (current - previous) / previous * 100)
+    change = np.where(current < 0, -100.0, change)
+    codes[..., 0] = first
+    codes[..., 1:] = (change > 0).astype(np.int8) - (change < THRESHOLD)
+    return codes
+
+
+def calculate_codes(data):
+    return change_codes(data, first=-1).tolist()
+
+
+def item_colors(data):
+    codes = change_codes(data, first=1)
+    colors = [COLORS[code] for code in codes.tolist()]
+    if colors:
+        colors[0] = 'blue'  # Default color for the first item
+    return colors
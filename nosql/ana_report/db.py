@@ -0,0 +1,363 @@
+"""
+This module provides shared PostgreSQL connection pools for the ana_report services.
+
+Instead of opening a new psycopg2 connection for every query, a single pool is created
+when the FastAPI application starts (see the lifespan handler in fastapp.py) and every
+request checks a connection out for the duration of its query.
+Features:
+- Bounded pool: requests wait (up to a timeout) for a free connection instead of failing
+  when all connections are in use.
+- Health checks: connections that are closed, or that have been idle longer than the
+  health check interval and no longer answer a `SELECT 1`, are replaced transparently.
+- Metrics: checkout count, pool wait time (total/avg/max), timeouts and reconnects.
+Functions:
+- init_pool(minconn, maxconn, timeout, healthcheck_interval, **connect_kwargs): Creates the shared pool.
+- close_pool(): Closes all pooled connections.
+- connection(): Context manager that checks a connection out of the shared pool.
+- pool_stats(): Returns the pool metrics as a dictionary.
+- init_async_pool(min_size, max_size, timeout, **connect_kwargs): Creates the shared asyncpg pool.
+- close_async_pool(): Closes the asyncpg pool.
+- fetch_rows(query, *args): Runs a query on the asyncpg pool without blocking the event loop.
+- stream_rows(query, *args, prefetch): Async generator yielding rows from a server-side cursor.
+- async_pool_stats(): Returns the asyncpg pool metrics as a dictionary.
+- listen(channel, callback, on_reconnect, retry_min, retry_max, healthcheck_interval, **connect_kwargs):
+  Starts a Listener on a dedicated connection that calls `callback(payload)` for every NOTIFY on
+  `channel`.
+Classes:
+- Listener: Keeps the LISTEN connection alive. A dropped connection (termination listener) or a
+  failed `SELECT 1` health check is reconnected with exponential backoff, and `on_reconnect()` is
+  called afterwards, since notifications sent while disconnected are lost. `stats()` returns the
+  connection state, notification count, reconnects and the last error.
+The asyncpg pool is used by the `async def` endpoints; queries use `$1, $2, ...` placeholders
+and JSONB values are decoded to Python objects.
+"""
+
+import asyncio
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+import asyncpg
+import psycopg2
+from psycopg2 import pool as pg_pool
+from psycopg2 import extensions
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes available within the configured timeout."""
+
+
+class ConnectionPool:
+    def __init__(self, minconn, maxconn, timeout=30.0, healthcheck_interval=30.0, **connect_kwargs):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.healthcheck_interval = healthcheck_interval
+        self._pool = pg_pool.ThreadedConnectionPool(minconn, maxconn, **connect_kwargs)
+        # ThreadedConnectionPool raises instead of blocking when exhausted,
+        # so the semaphore makes callers queue for a free slot
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._last_used = {}
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self._checkouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._timeouts = 0
+        self._reconnects = 0
+
+    @contextmanager
+    def connection(self):
+        start = time.perf_counter()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self._timeouts += 1
+            raise PoolTimeout(f"No database connection available within {self.timeout}s")
+        conn = None
+        try:
+            conn = self._checkout()
+            waited = time.perf_counter() - start
+            with self._lock:
+                self._in_use += 1
+                self._checkouts += 1
+                self._wait_total += waited
+                self._wait_max = max(self._wait_max, waited)
+            yield conn
+        finally:
+            if conn is not None:
+                self._checkin(conn)
+            self._slots.release()
+
+    def _checkout(self):
+        conn = self._pool.getconn()
+        if not self._is_healthy(conn):
+            self._pool.putconn(conn, close=True)
+            self._last_used.pop(id(conn), None)
+            conn = self._pool.getconn()
+            with self._lock:
+                self._reconnects += 1
+        return conn
+
+    def _checkin(self, conn):
+        with self._lock:
+            self._in_use -= 1
+        broken = conn.closed != 0
+        if not broken:
+            try:
+                # Never hand out a connection with an open transaction
+                if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                broken = True
+        if broken:
+            self._last_used.pop(id(conn), None)
+        else:
+            self._last_used[id(conn)] = time.monotonic()
+        self._pool.putconn(conn, close=broken)
+
+    def _is_healthy(self, conn):
+        if conn.closed:
+            return False
+        last_used = self._last_used.get(id(conn))
+        if last_used is not None and time.monotonic() - last_used < self.healthcheck_interval:
+            return True  # Recently used, skip the round-trip
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def stats(self):
+        with self._lock:
+            return {
+                "min_size": self.minconn,
+                "max_size": self.maxconn,
+                "in_use": self._in_use,
+                "checkouts": self._checkouts,
+                "wait_time_total_ms": round(self._wait_total * 1000, 3),
+                "wait_time_avg_ms": round(self._wait_total * 1000 / self._checkouts, 3) if self._checkouts else 0.0,
+                "wait_time_max_ms": round(self._wait_max * 1000, 3),
+                "timeouts": self._timeouts,
+                "reconnects": self._reconnects,
+            }
+
+    def close(self):
+        self._pool.closeall()
+        self._last_used.clear()
+
+
+_pool = None
+
+
+def init_pool(minconn, maxconn, timeout=30.0, healthcheck_interval=30.0, **connect_kwargs):
+    global _pool
+    if _pool is None:
+        _pool = ConnectionPool(minconn, maxconn, timeout, healthcheck_interval, **connect_kwargs)
+    return _pool
+
+
+def close_pool():
+    global _pool
+    if _pool is not None:
+        _pool.close()
+        _pool = None
+
+
+def connection():
+    if _pool is None:
+        raise RuntimeError("Connection pool is not initialized, call init_pool() first")
+    return _pool.connection()
+
+
+def pool_stats():
+    if _pool is None:
+        return {}
+    return _pool.stats()
+
+
+_async_pool = None
+_async_stats = {"checkouts": 0, "wait_time_total": 0.0, "wait_time_max": 0.0}
+
+
+async def _init_connection(conn):
+    # Decode JSON/JSONB columns to lists/dicts, like psycopg2 does
+    for typename in ("json", "jsonb"):
+        await conn.set_type_codec(typename, encoder=json.dumps, decoder=json.loads, schema="pg_catalog")
+
+
+async def init_async_pool(min_size, max_size, timeout=30.0, **connect_kwargs):
+    global _async_pool
+    if _async_pool is None:
+        _async_pool = await asyncpg.create_pool(
+            min_size=min_size,
+            max_size=max_size,
+            timeout=timeout,
+            init=_init_connection,
+            **connect_kwargs
+        )
+    return _async_pool
+
+
+async def close_async_pool():
+    global _async_pool
+    if _async_pool is not None:
+        await _async_pool.close()
+        _async_pool = None
+
+
+async def fetch_rows(query, *args):
+    if _async_pool is None:
+        raise RuntimeError("Async connection pool is not initialized, call init_async_pool() first")
+    start = time.perf_counter()
+    async with _async_pool.acquire() as conn:
+        waited = time.perf_counter() - start
+        _async_stats["checkouts"] += 1
+        _async_stats["wait_time_total"] += waited
+        _async_stats["wait_time_max"] = max(_async_stats["wait_time_max"], waited)
+        return await conn.fetch(query, *args)
+
+
+async def stream_rows(query, *args, prefetch=500):
+    if _async_pool is None:
+        raise RuntimeError("Async connection pool is not initialized, call init_async_pool() first")
+    start = time.perf_counter()
+    async with _async_pool.acquire() as conn:
+        waited = time.perf_counter() - start
+        _async_stats["checkouts"] += 1
+        _async_stats["wait_time_total"] += waited
+        _async_stats["wait_time_max"] = max(_async_stats["wait_time_max"], waited)
+        # Cursors only exist inside a transaction
+        async with conn.transaction():
+            async for row in conn.cursor(query, *args, prefetch=prefetch):
+                yield row
+
+
+def async_pool_stats():
+    if _async_pool is None:
+        return {}
+    checkouts = _async_stats["checkouts"]
+    return {
+        "min_size": _async_pool.get_min_size(),
+        "max_size": _async_pool.get_max_size(),
+        "size": _async_pool.get_size(),
+        "idle": _async_pool.get_idle_size(),
+        "checkouts": checkouts,
+        "wait_time_total_ms": round(_async_stats["wait_time_total"] * 1000, 3),
+        "wait_time_avg_ms": round(_async_stats["wait_time_total"] * 1000 / checkouts, 3) if checkouts else 0.0,
+        "wait_time_max_ms": round(_async_stats["wait_time_max"] * 1000, 3),
+    }
+
+
+class Listener:
+    def __init__(self, channel, callback, on_reconnect=None, retry_min=1.0, retry_max=60.0,
+                 healthcheck_interval=30.0, **connect_kwargs):
+        self.channel = channel
+        self.callback = callback
+        self.on_reconnect = on_reconnect
+        self.retry_min = retry_min
+        self.retry_max = retry_max
+        self.healthcheck_interval = healthcheck_interval
+        self.connect_kwargs = connect_kwargs
+        self._conn = None
+        self._lost = asyncio.Event()
+        self._task = None
+        self._notifications = 0
+        self._reconnects = 0
+        self._failed_attempts = 0
+        self._last_error = None
+        self._disconnected_at = None
+
+    async def start(self):
+        # The first connection is made before startup completes, so a wrong configuration fails fast
+        await self._connect()
+        self._task = asyncio.create_task(self._run())
+
+    async def _connect(self):
+        # LISTEN needs its own long-lived connection, outside the pool
+        conn = await asyncpg.connect(**self.connect_kwargs)
+        try:
+            await conn.add_listener(self.channel, self._notify)
+            conn.add_termination_listener(self._terminated)
+        except BaseException:
+            conn.terminate()
+            raise
+        self._conn = conn
+        self._lost.clear()
+        self._disconnected_at = None
+
+    def _notify(self, _conn, _pid, _channel, payload):
+        self._notifications += 1
+        self.callback(payload)
+
+    def _terminated(self, conn):
+        if conn is self._conn:
+            self._lost.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._lost.wait(), timeout=self.healthcheck_interval)
+            except asyncio.TimeoutError:
+                # No termination seen, but a silent network failure only shows up on use
+                try:
+                    await asyncio.wait_for(self._conn.fetchval("SELECT 1"), timeout=self.healthcheck_interval)
+                    continue
+                except (OSError, asyncio.TimeoutError, asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+                    self._last_error = f"health check failed: {e!r}"
+            await self._reconnect()
+
+    async def _reconnect(self):
+        self._disconnected_at = time.time()
+        print(f"LISTEN {self.channel}: connection lost, reconnecting")
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            conn.terminate()
+        delay = self.retry_min
+        while True:
+            try:
+                await self._connect()
+                break
+            except (OSError, asyncio.TimeoutError, asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+                self._failed_attempts += 1
+                self._last_error = repr(e)
+                print(f"LISTEN {self.channel}: reconnect failed ({e!r}), retrying in {delay:.0f}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.retry_max)
+        self._reconnects += 1
+        print(f"LISTEN {self.channel}: reconnected")
+        if self.on_reconnect is not None:
+            self.on_reconnect()
+
+    def stats(self):
+        return {
+            "channel": self.channel,
+            "connected": self._conn is not None and not self._conn.is_closed() and not self._lost.is_set(),
+            "disconnected_since": self._disconnected_at,
+            "notifications": self._notifications,
+            "reconnects": self._reconnects,
+            "failed_attempts": self._failed_attempts,
+            "last_error": self._last_error,
+        }
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            await conn.close()
+
+
+async def listen(channel, callback, on_reconnect=None, retry_min=1.0, retry_max=60.0,
+                 healthcheck_interval=30.0, **connect_kwargs):
+    listener = Listener(channel, callback, on_reconnect, retry_min, retry_max,
+                        healthcheck_interval, **connect_kwargs)
+    await listener.start()
+    return listener
@@ -16,34 +16,91 @@ Environment Variables:
 - POSTGRES_DB: PostgreSQL database name.
 - POSTGRES_HOST: PostgreSQL host address.
 - POSTGRES_PORT: PostgreSQL port.
+- POSTGRES_POOL_MIN: Minimum number of pooled connections (default 1).
+- POSTGRES_POOL_MAX: Maximum number of pooled connections (default 10).
+- POSTGRES_POOL_TIMEOUT: Seconds a request waits for a free connection (default 30).
+- POSTGRES_POOL_HEALTHCHECK: Idle seconds after which a connection is pinged before reuse (default 30).
+  The notification listener pings its connection at the same interval.
+- CACHE_TTL_SECONDS: Lifetime of cached symbol/plot responses (default 3600).
+- CACHE_MAX_ENTRIES: Maximum number of cached responses, least recently used are evicted (default 1024).
+- FIGURE_CACHE_MAX_ENTRIES: Maximum number of cached rendered figures and bar color lists (default 512).
+- REPORT_DIR: Directory of the PDF reports built by report jobs (default "reports").
+- REPORT_WORKERS: Number of reports built at the same time (default 1).
+- REPORT_CHART_WORKERS: Processes rendering the charts of one report (default 2).
+- REPORT_MAX_JOBS: Finished report jobs kept, with their PDF, before the oldest are deleted (default 100).
+- REPORT_MAX_AGE_SECONDS: Age after which a finished report job and its PDF are deleted (default 86400).
+- CHART_CACHE_DIR, CHART_CACHE_MAX_MB: On-disk chart cache shared with report.py.
+- SIMILARITY_QUARTERS: Number of last market cap quarters compared by /similarity (default 65).
+- SIMILARITY_WORKERS: Processes computing the distances of one reference (default 0, in the request thread).
+- SIMILARITY_MAX_REFERENCES: Maximum number of references whose distances are cached (default 256).
+- SERIES_STORE_DIR: Store of the standardized series used by /similarity (see dtaidistance/series_store.py).
+- SIMILARITY_DIR: Directory of similarity.py (default "../dtaidistance" next to this module).
 Functions:
-- fetch_data(query): Executes a SQL query on the PostgreSQL database and returns the result as a pandas DataFrame.
+- fetch_data(query): Executes a SQL query on a pooled connection and returns the result as a pandas DataFrame.
+- fetch_symbol_metric(symbol, metric, normalized, label): Fetches one quarterly metric for a symbol on the
+  asyncpg pool, so the `/data/{metric}/{symbol}` endpoints never block the event loop.
+- metrics_query(metrics): Builds the query shared by the per-symbol endpoints and POST "/data/batch".
 - categorize_company(data): Categorizes companies based on the average change in their financial data.
+  GET "/data" reads the same categories from stored columns maintained by PostgreSQL.
 - get_item_color(data): Determines the color for each value in a dataset based on percentage change.
 - generate_plot(data, title): Generates a Plotly bar chart for the given data and returns it as an HTML string.
+- render_plot(symbol, metric, data, format): Returns the chart as HTML or Plotly JSON from the figure cache,
+  rendering it only when the data hash is not cached yet.
 Endpoints:
 - GET "/": Renders the main HTML page using Jinja2 templates.
 - GET "/data": Fetches and filters financial data based on market capitalization and ROIC thresholds.
+  `?format=ndjson` streams one symbol record per line instead of building one JSON object.
 - GET "/plot/{symbol}": Generates a Plotly visualization for a specific company's financial metric.
+  `?format=json` returns the Plotly figure JSON for client-side rendering instead of HTML.
+- POST "/data/batch": Returns metrics for many symbols from one query, streamed as NDJSON
+  (one `{"symbol": ..., "<metric>": [...]}` object per line). Unknown symbols follow as
+  `{"symbol": ..., "error": "not found"}` lines, so every requested symbol gets exactly one line.
+- GET "/metrics/pool": Returns connection pool metrics (checkouts, wait time, timeouts, reconnects).
+- GET "/cache/stats": Returns response and figure cache hit/miss counters, and the state of the
+  companies_changed listener (connected, reconnects, last error).
+- POST "/cache/invalidate": Drops cached responses for one symbol (`?symbol=`) or all of them.
+- POST "/reports": Enqueues a PDF report build for the given filters and returns the job (202).
+  A build for the same filters is reused while it is queued, running or done and the data is unchanged.
+- GET "/reports/{id}": Returns the job status (queued, running, done, failed) and its progress.
+- GET "/reports/{id}/pdf": Serves the finished PDF with FileResponse.
+- GET "/similarity/{symbol}": Returns the `k` symbols whose standardized market cap is closest to the
+  symbol by DTW distance (dtaidistance/similarity.py); the distances to all symbols are stored in
+  dtw_similarity and cached per reference. The module is imported at the first request, from
+  SIMILARITY_DIR; without it (or without the dtaidistance package) the endpoint returns 503.
+Caching:
+Responses of the symbol and plot endpoints are cached per (endpoint, symbol, metric). Entries are
+dropped when the `companies_changed` notification (postgres/migrations/002_companies_notify.sql)
+reports that a company row changed. Rendered figures and their bar colors are cached separately
+per (symbol, metric, data hash), so a plot is only re-rendered when its data actually changed.
+The listener reconnects with backoff when its connection drops and then invalidates everything,
+since notifications sent while it was disconnected are lost.
 Usage:
 Run the application using the command `uvicorn fastapp:app --host 0.0.0.0 --port 8001`.
 
 """
 
 from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import HTMLResponse, JSONResponse, FileResponse
+from fastapi.responses import HTMLResponse, JSONResponse, FileResponse, StreamingResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-import psycopg2
 import pandas as pd
 from dotenv import load_dotenv
 import os
 import numpy as np
 import plotly.express as px
 import uvicorn
-#from report import generate_report
+from contextlib import asynccontextmanager
+import db
+from classify import item_colors
+from cache import TTLCache, MISSING
+from report_jobs import ReportJobs
+import sys
+import threading
 import re
-from typing import Optional, Tuple
+import json
+import hashlib
+from typing import List, Optional, Tuple
+from pydantic import BaseModel
 
 # Load environment variables
 load_dotenv()
@@ -53,9 +110,133 @@ POSTGRES_PASSWORD = os.getenv('POSTGRES_PASSWORD', 'mypassword')
 POSTGRES_DB = os.getenv('POSTGRES_DB', 'mydatabase')
 POSTGRES_HOST = os.getenv('POSTGRES_HOST', 'localhost')
 POSTGRES_PORT = os.getenv('POSTGRES_PORT', '5432')
+POSTGRES_POOL_MIN = int(os.getenv('POSTGRES_POOL_MIN', '1'))
+POSTGRES_POOL_MAX = int(os.getenv('POSTGRES_POOL_MAX', '10'))
+POSTGRES_POOL_TIMEOUT = float(os.getenv('POSTGRES_POOL_TIMEOUT', '30'))
+POSTGRES_POOL_HEALTHCHECK = float(os.getenv('POSTGRES_POOL_HEALTHCHECK', '30'))
+CACHE_TTL_SECONDS = float(os.getenv('CACHE_TTL_SECONDS', '3600'))
+CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', '1024'))
+FIGURE_CACHE_MAX_ENTRIES = int(os.getenv('FIGURE_CACHE_MAX_ENTRIES', '512'))
+REPORT_DIR = os.getenv('REPORT_DIR', 'reports')
+REPORT_WORKERS = int(os.getenv('REPORT_WORKERS', '1'))
+REPORT_CHART_WORKERS = int(os.getenv('REPORT_CHART_WORKERS', '2'))
+REPORT_MAX_JOBS = int(os.getenv('REPORT_MAX_JOBS', '100'))
+REPORT_MAX_AGE_SECONDS = float(os.getenv('REPORT_MAX_AGE_SECONDS', '86400'))
+CHART_CACHE_DIR = os.getenv('CHART_CACHE_DIR', 'chart_cache')
+CHART_CACHE_MAX_MB = int(os.getenv('CHART_CACHE_MAX_MB', '512'))
+SIMILARITY_QUARTERS = int(os.getenv('SIMILARITY_QUARTERS', '65'))
+SIMILARITY_WORKERS = int(os.getenv('SIMILARITY_WORKERS', '0'))
+SIMILARITY_MAX_REFERENCES = int(os.getenv('SIMILARITY_MAX_REFERENCES', '256'))
+SIMILARITY_DIR = os.getenv('SIMILARITY_DIR',
+                           os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dtaidistance'))
 #print (POSTGRES_HOST)
+
+SYMBOL_PATTERN = re.compile(r'^[A-Za-z0-9:]+$')
+METRICS = ('revenue', 'market_cap', 'roic')
+BATCH_MAX_SYMBOLS = 5000
+SIMILARITY_MAX_K = 1000
+
+# Cache for symbol and plot responses, keyed by (endpoint, symbol, metric)
+response_cache = TTLCache(maxsize=CACHE_MAX_ENTRIES, ttl=CACHE_TTL_SECONDS)
+# Rendered figures per format and bar colors, keyed by (symbol, metric, data hash)
+figure_cache = TTLCache(maxsize=FIGURE_CACHE_MAX_ENTRIES, ttl=CACHE_TTL_SECONDS)
+
+# Background PDF report builds
+report_jobs = ReportJobs(
+    REPORT_DIR,
+    workers=REPORT_WORKERS,
+    chart_workers=REPORT_CHART_WORKERS,
+    cache_dir=CHART_CACHE_DIR,
+    cache_max_bytes=CHART_CACHE_MAX_MB * 1024 * 1024,
+    max_jobs=REPORT_MAX_JOBS,
+    max_age=REPORT_MAX_AGE_SECONDS
+)
+
+# Standardized market cap series for DTW similarity queries, created at the first query
+similarity_index = None
+similarity_lock = threading.Lock()
+
+# Import the similarity service lazily: it lives outside ana_report and needs dtaidistance,
+# so an image without them still serves every other endpoint; raises ImportError
+def get_similarity_index():
+    global similarity_index
+    with similarity_lock:
+        if similarity_index is None:
+            if SIMILARITY_DIR not in sys.path:
+                sys.path.insert(0, SIMILARITY_DIR)
+            from similarity import SimilarityIndex
+            similarity_index = SimilarityIndex(
+                db.connection,
+                n_quarters=SIMILARITY_QUARTERS,
+                workers=SIMILARITY_WORKERS,
+                max_references=SIMILARITY_MAX_REFERENCES,
+                cache_ttl=CACHE_TTL_SECONDS
+            )
+        return similarity_index
+
+# Invalidation hook: an empty payload means the whole table changed
+# Any change can move a company across the report thresholds, so cached reports are dropped too
+# A changed series changes the distances of every reference, so the similarity series are reloaded
+def on_companies_changed(symbol: str):
+    response_cache.invalidate(symbol or None)
+    report_jobs.invalidate()
+    if similarity_index is not None:
+        similarity_index.invalidate()
+
+# Notifications sent while the listener was disconnected are lost, so everything is dropped
+# Figures are keyed by the hash of their data and cannot go stale
+def on_listener_reconnect():
+    on_companies_changed('')
+
+# LISTEN connection for companies_changed, created at startup
+listener = None
+
+# Create the shared connection pools at startup and close them on shutdown
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global listener
+    db.init_pool(
+        POSTGRES_POOL_MIN,
+        POSTGRES_POOL_MAX,
+        timeout=POSTGRES_POOL_TIMEOUT,
+        healthcheck_interval=POSTGRES_POOL_HEALTHCHECK,
+        user=POSTGRES_USER,
+        password=POSTGRES_PASSWORD,
+        host=POSTGRES_HOST,
+        port=POSTGRES_PORT,
+        database=POSTGRES_DB
+    )
+    await db.init_async_pool(
+        POSTGRES_POOL_MIN,
+        POSTGRES_POOL_MAX,
+        timeout=POSTGRES_POOL_TIMEOUT,
+        user=POSTGRES_USER,
+        password=POSTGRES_PASSWORD,
+        host=POSTGRES_HOST,
+        port=int(POSTGRES_PORT),
+        database=POSTGRES_DB
+    )
+    listener = await db.listen(
+        'companies_changed',
+        on_companies_changed,
+        on_reconnect=on_listener_reconnect,
+        healthcheck_interval=POSTGRES_POOL_HEALTHCHECK,
+        user=POSTGRES_USER,
+        password=POSTGRES_PASSWORD,
+        host=POSTGRES_HOST,
+        port=int(POSTGRES_PORT),
+        database=POSTGRES_DB
+    )
+    report_jobs.start()
+    yield
+    report_jobs.stop()
+    await listener.close()
+    listener = None
+    await db.close_async_pool()
+    db.close_pool()
+
 # Initialize FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Mount static files and templates
 app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -75,21 +256,15 @@ templates = Jinja2Templates(directory="templates")
 #    return df
 
 # Updated fetch_data function to support parameterized queries
+# Connections are checked out of the shared pool instead of opened per call
 def fetch_data(query: str, params: Optional[Tuple] = None) -> pd.DataFrame:
     try:
-        conn = psycopg2.connect(
-            user=POSTGRES_USER,
-            password=POSTGRES_PASSWORD,
-            host=POSTGRES_HOST,
-            port=POSTGRES_PORT,
-            database=POSTGRES_DB
-        )
-        # Use parameterized query if params are provided
-        if params:
-            df = pd.read_sql(query, conn, params=params)
-        else:
-            df = pd.read_sql(query, conn)
-        conn.close()
+        with db.connection() as conn:
+            # Use parameterized query if params are provided
+            if params:
+                df = pd.read_sql(query, conn, params=params)
+            else:
+                df = pd.read_sql(query, conn)
         return df
     except Exception as e:
         raise Exception(f"Database error: {str(e)}")
@@ -115,29 +290,12 @@ def categorize_company(data):
         return 'Cluster 2: Cyclical patterns'
 
 # Function to get color for each value based on percentage change
+# The -7% classification is shared with the advisor, see classify.py
 def get_item_color(data):
-    colors = []
-    for i in range(len(data)):
-        if i == 0:  # No previous value for the first item
-            colors.append('blue')  # Default color for the first item
-        else:
-            if data[i - 1] == 0:
-                change = 0
-            else:
-                change = (data[i] - data[i - 1]) / data[i - 1] * 100  # Percentage change
-            if data[i] < 0:
-                change = -100  # Negative change
-            if change > 0:
-                colors.append('green')  # Positive change
-            elif -7 <= change <= 0:
-                colors.append('orange')  # Small negative or no change
-            elif change < -7:
-                colors.append('red')  # Large negative change
-    return colors
+    return item_colors(data)
 
 # Function to generate a Plotly bar chart
-def generate_plot(data, title):
-    colors = get_item_color(data)  # Get colors for each bar
+def build_figure(data, title, colors):
     fig = px.bar(
         x=[f"Q{i+1}" for i in range(len(data))],  # Labels for the x-axis
         y=data,  # Data for the y-axis
@@ -145,7 +303,29 @@ def generate_plot(data, title):
     )
     # Update the bar colors
     fig.update_traces(marker_color=colors)
-    return fig.to_html(full_html=False)
+    return fig
+
+def generate_plot(data, title):
+    colors = get_item_color(data)  # Get colors for each bar
+    return build_figure(data, title, colors).to_html(full_html=False)
+
+# Render a plot as HTML or Plotly JSON, reusing earlier renders of the same data
+# Figures are keyed by a hash of the data, so a changed series is never served stale
+# Every format and the bar colors are separate entries, cached values are never modified
+def render_plot(symbol, metric, data, format):
+    digest = hashlib.sha1(json.dumps(data).encode()).hexdigest()
+    cache_key = ('figure', symbol, metric, digest, format)
+    plot = figure_cache.get(cache_key)
+    if plot is MISSING:
+        colors_key = ('colors', symbol, metric, digest)
+        colors = figure_cache.get(colors_key)
+        if colors is MISSING:
+            colors = tuple(get_item_color(data))
+            figure_cache.set(colors_key, colors)
+        fig = build_figure(data, f"{symbol} {metric.capitalize()}", list(colors))
+        plot = fig.to_json() if format == 'json' else fig.to_html(full_html=False)
+        figure_cache.set(cache_key, plot)
+    return plot
 
 # Endpoint to render the main HTML page
 @app.get("/", response_class=HTMLResponse)
@@ -181,236 +361,157 @@ def read_root(request: Request):
 #    return JSONResponse(content=result)
 #
 
+# Yield one JSON line per symbol from a server-side cursor, skipping duplicate symbols
+# Symbols in `expected` without a row are reported at the end, one error line each
+async def stream_records(query, *args, transform=None, expected=None):
+    seen = set()
+    async for row in db.stream_rows(query, *args):
+        if row['symbol'] in seen:
+            continue
+        seen.add(row['symbol'])
+        record = dict(row)
+        if transform is not None:
+            record = transform(record)
+        yield json.dumps(record) + "\n"
+    for symbol in expected or ():
+        if symbol not in seen:
+            yield json.dumps({"symbol": symbol, "error": "not found"}) + "\n"
+
 # Existing endpoint (for reference)
+# The categories are stored generated columns (postgres/migrations/001_trend_categories.sql),
+# computed by PostgreSQL when a company row changes instead of on every request
+# With format=ndjson the rows are streamed from a server-side cursor, one symbol per line,
+# so memory stays flat and the first byte is sent before the whole table is read
 @app.get("/data")
-def get_data():
+def get_data(format: str = "json"):
+    if format not in ("json", "ndjson"):
+        raise HTTPException(status_code=400, detail="Invalid format. Use 'json' or 'ndjson'.")
+
     query = """
     SELECT 
-        data->>'qfs_symbol_v2' AS symbol,
+        symbol,
         COALESCE(data->'financials'->'quarterly'->'revenue', '[]'::jsonb) AS revenue,
         COALESCE(data->'financials'->'quarterly'->'market_cap', '[]'::jsonb) AS market_cap,
         COALESCE(data->'financials'->'quarterly'->'roic', '[]'::jsonb) AS roic,
-        data->'metadata'->>'sector' AS sector
+        data->'metadata'->>'sector' AS sector,
+        revenue_category,
+        market_cap_category,
+        roic_category
     FROM companies;
     """
+    if format == "ndjson":
+        return StreamingResponse(stream_records(query), media_type="application/x-ndjson")
+
     df = fetch_data(query)
-    
-    df['revenue_category'] = df['revenue'].apply(categorize_company)
-    df['market_cap_category'] = df['market_cap'].apply(categorize_company)
-    df['roic_category'] = df['roic'].apply(categorize_company)
 
     df = df.drop_duplicates(subset='symbol')
     result = df.set_index('symbol').to_dict(orient="index")
     
     return JSONResponse(content=result)
 
-@app.get("/data/market_cap/{symbol}")
-async def get_symbol_data(symbol: str):
-    # Validate the symbol input to allow alphanumeric characters and colon
-    if not symbol or not re.match(r'^[A-Za-z0-9:]+$', symbol):
+# Validate the symbol input to allow alphanumeric characters and colon
+def validate_symbol(symbol: str):
+    if not symbol or not SYMBOL_PATTERN.match(symbol):
         raise HTTPException(status_code=400, detail="Invalid symbol format. Use alphanumeric characters and colon only.")
 
     if len(symbol) > 50:
         raise HTTPException(status_code=400, detail="Symbol is too long.")
 
-    # Use parameterized query to prevent SQL injection
-    query = """
+# Build the query selecting the given quarterly metrics for a list of symbols ($1)
+# Metrics are checked against METRICS before they are put into the SQL
+# The values stay JSONB so the API returns the numbers exactly as stored
+def metrics_query(metrics):
+    columns = ",\n        ".join(
+        f"COALESCE(data->'financials'->'quarterly'->'{metric}', '[]'::jsonb) AS {metric}"
+        for metric in metrics
+    )
+    return f"""
     SELECT
-        data->>'qfs_symbol_v2' AS symbol,
-        COALESCE(data->'financials'->'quarterly'->'market_cap', '[]'::jsonb) AS market_cap
+        symbol,
+        {columns}
     FROM companies
-    WHERE data->>'qfs_symbol_v2' = %s;
+    WHERE symbol = ANY($1::text[]);
     """
-    try:
-        # Call fetch_data with query and parameters
-        df = fetch_data(query, (symbol,))  # Expects fetch_data to handle both arguments
 
-        if df.empty:
-            raise HTTPException(status_code=404, detail=f"No data found for symbol {symbol}")
+# Fetch one quarterly metric for a symbol on the async pool, optionally normalized
+async def fetch_symbol_metric(symbol: str, metric: str, normalized: bool, label: str):
+    validate_symbol(symbol)
 
-        # Drop duplicates and convert to dictionary
-        df = df.drop_duplicates(subset='symbol')
-        result = df.set_index('symbol').to_dict(orient="index")
-
-        return JSONResponse(content=result)
+    cache_key = ('normalized' if normalized else 'data', symbol, metric)
+    cached = response_cache.get(cache_key)
+    if cached is not MISSING:
+        return JSONResponse(content=cached)
 
+    try:
+        rows = await db.fetch_rows(metrics_query([metric]), [symbol])
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
-@app.get("/data/revenue/{symbol}")
-async def get_symbol_revenue(symbol: str):
-    # Validate the symbol input to allow alphanumeric characters and colon
-    if not symbol or not re.match(r'^[A-Za-z0-9:]+$', symbol):
-        raise HTTPException(status_code=400, detail="Invalid symbol format. Use alphanumeric characters and colon only.")
+    if not rows:
+        raise HTTPException(status_code=404, detail=f"No {label} found for symbol {symbol}")
 
-    if len(symbol) > 50:
-        raise HTTPException(status_code=400, detail="Symbol is too long.")
+    # Keep the first row per symbol, like drop_duplicates did
+    values = rows[0][metric]
+    if normalized:
+        values = normalize_array(values)
 
-    # Use parameterized query to prevent SQL injection
-    query = """
-    SELECT
-        data->>'qfs_symbol_v2' AS symbol,
-        COALESCE(data->'financials'->'quarterly'->'revenue', '[]'::jsonb) AS revenue
-    FROM companies
-    WHERE data->>'qfs_symbol_v2' = %s;
-    """
-    try:
-        # Call fetch_data with query and parameters
-        df = fetch_data(query, (symbol,))
-
-        if df.empty:
-            raise HTTPException(status_code=404, detail=f"No revenue data found for symbol {symbol}")
-
-        # Drop duplicates and convert to dictionary
-        df = df.drop_duplicates(subset='symbol')
-        result = df.set_index('symbol').to_dict(orient="index")
+    result = {rows[0]['symbol']: {metric: values}}
+    response_cache.set(cache_key, result)
+    return JSONResponse(content=result)
 
-        return JSONResponse(content=result)
+# Request body for POST /data/batch
+class BatchRequest(BaseModel):
+    symbols: List[str]
+    metrics: List[str] = list(METRICS)
+    normalized: bool = False
+
+# Fetch several metrics for many symbols with a single query, streamed as NDJSON
+@app.post("/data/batch")
+async def get_batch_data(request: BatchRequest):
+    if len(request.symbols) > BATCH_MAX_SYMBOLS:
+        raise HTTPException(status_code=400, detail=f"Too many symbols, the maximum is {BATCH_MAX_SYMBOLS}.")
+    for symbol in request.symbols:
+        validate_symbol(symbol)
+    invalid = [metric for metric in request.metrics if metric not in METRICS]
+    if invalid or not request.metrics:
+        raise HTTPException(status_code=400, detail=f"Invalid metrics {invalid}. Choose from {list(METRICS)}.")
+
+    metrics = list(dict.fromkeys(request.metrics))
+    query = metrics_query(metrics)
+    symbols = list(dict.fromkeys(request.symbols))
+
+    def normalize(record):
+        for metric in metrics:
+            record[metric] = normalize_array(record[metric])
+        return record
+
+    transform = normalize if request.normalized else None
+    return StreamingResponse(stream_records(query, symbols, transform=transform, expected=symbols),
+                             media_type="application/x-ndjson")
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+@app.get("/data/market_cap/{symbol}")
+async def get_symbol_data(symbol: str):
+    return await fetch_symbol_metric(symbol, 'market_cap', False, "data")
 
+@app.get("/data/revenue/{symbol}")
+async def get_symbol_revenue(symbol: str):
+    return await fetch_symbol_metric(symbol, 'revenue', False, "revenue data")
 
 @app.get("/data/roic/{symbol}")
 async def get_symbol_roic(symbol: str):
-    # Validate the symbol input to allow alphanumeric characters and colon
-    if not symbol or not re.match(r'^[A-Za-z0-9:]+$', symbol):
-        raise HTTPException(status_code=400, detail="Invalid symbol format. Use alphanumeric characters and colon only.")
-
-    if len(symbol) > 50:
-        raise HTTPException(status_code=400, detail="Symbol is too long.")
-
-    # Use parameterized query to prevent SQL injection
-    query = """
-    SELECT
-        data->>'qfs_symbol_v2' AS symbol,
-        COALESCE(data->'financials'->'quarterly'->'roic', '[]'::jsonb) AS roic
-    FROM companies
-    WHERE data->>'qfs_symbol_v2' = %s;
-    """
-    try:
-        # Call fetch_data with query and parameters
-        df = fetch_data(query, (symbol,))
-
-        if df.empty:
-            raise HTTPException(status_code=404, detail=f"No ROIC data found for symbol {symbol}")
-
-        # Drop duplicates and convert to dictionary
-        df = df.drop_duplicates(subset='symbol')
-        result = df.set_index('symbol').to_dict(orient="index")
-
-        return JSONResponse(content=result)
-
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+    return await fetch_symbol_metric(symbol, 'roic', False, "ROIC data")
 
 @app.get("/data/market_cap/normalized/{symbol}")
 async def get_symbol_market_cap_normalized(symbol: str):
-    # Validate the symbol input to allow alphanumeric characters and colon
-    if not symbol or not re.match(r'^[A-Za-z0-9:]+$', symbol):
-        raise HTTPException(status_code=400, detail="Invalid symbol format. Use alphanumeric characters and colon only.")
-
-    if len(symbol) > 50:
-        raise HTTPException(status_code=400, detail="Symbol is too long.")
-
-    # Use parameterized query to prevent SQL injection
-    query = """
-    SELECT
-        data->>'qfs_symbol_v2' AS symbol,
-        COALESCE(data->'financials'->'quarterly'->'market_cap', '[]'::jsonb) AS market_cap
-    FROM companies
-    WHERE data->>'qfs_symbol_v2' = %s;
-    """
-    try:
-        # Call fetch_data with query and parameters
-        df = fetch_data(query, (symbol,))
-
-        if df.empty:
-            raise HTTPException(status_code=404, detail=f"No market cap data found for symbol {symbol}")
-
-        # Normalize the market_cap data
-        df['market_cap'] = df['market_cap'].apply(normalize_array)
-
-        # Drop duplicates and convert to dictionary
-        df = df.drop_duplicates(subset='symbol')
-        result = df.set_index('symbol').to_dict(orient="index")
-
-        return JSONResponse(content=result)
-
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+    return await fetch_symbol_metric(symbol, 'market_cap', True, "market cap data")
 
 @app.get("/data/revenue/normalized/{symbol}")
 async def get_symbol_revenue_normalized(symbol: str):
-    # Validate the symbol input to allow alphanumeric characters and colon
-    if not symbol or not re.match(r'^[A-Za-z0-9:]+$', symbol):
-        raise HTTPException(status_code=400, detail="Invalid symbol format. Use alphanumeric characters and colon only.")
-
-    if len(symbol) > 50:
-        raise HTTPException(status_code=400, detail="Symbol is too long.")
-
-    # Use parameterized query to prevent SQL injection
-    query = """
-    SELECT
-        data->>'qfs_symbol_v2' AS symbol,
-        COALESCE(data->'financials'->'quarterly'->'revenue', '[]'::jsonb) AS revenue
-    FROM companies
-    WHERE data->>'qfs_symbol_v2' = %s;
-    """
-    try:
-        # Call fetch_data with query and parameters
-        df = fetch_data(query, (symbol,))
-
-        if df.empty:
-            raise HTTPException(status_code=404, detail=f"No revenue data found for symbol {symbol}")
-
-        # Normalize the revenue data
-        df['revenue'] = df['revenue'].apply(normalize_array)
-
-        # Drop duplicates and convert to dictionary
-        df = df.drop_duplicates(subset='symbol')
-        result = df.set_index('symbol').to_dict(orient="index")
-
-        return JSONResponse(content=result)
-
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+    return await fetch_symbol_metric(symbol, 'revenue', True, "revenue data")
 
 @app.get("/data/roic/normalized/{symbol}")
 async def get_symbol_roic_normalized(symbol: str):
-    # Validate the symbol input to allow alphanumeric characters and colon
-    if not symbol or not re.match(r'^[A-Za-z0-9:]+$', symbol):
-        raise HTTPException(status_code=400, detail="Invalid symbol format. Use alphanumeric characters and colon only.")
-
-    if len(symbol) > 50:
-        raise HTTPException(status_code=400, detail="Symbol is too long.")
-
-    # Use parameterized query to prevent SQL injection
-    query = """
-    SELECT
-        data->>'qfs_symbol_v2' AS symbol,
-        COALESCE(data->'financials'->'quarterly'->'roic', '[]'::jsonb) AS roic
-    FROM companies
-    WHERE data->>'qfs_symbol_v2' = %s;
-    """
-    try:
-        # Call fetch_data with query and parameters
-        df = fetch_data(query, (symbol,))
-
-        if df.empty:
-            raise HTTPException(status_code=404, detail=f"No ROIC data found for symbol {symbol}")
-
-        # Normalize the roic data
-        df['roic'] = df['roic'].apply(normalize_array)
-
-        # Drop duplicates and convert to dictionary
-        df = df.drop_duplicates(subset='symbol')
-        result = df.set_index('symbol').to_dict(orient="index")
-
-        return JSONResponse(content=result)
-
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+    return await fetch_symbol_metric(symbol, 'roic', True, "ROIC data")
 
 # New endpoint: /data/symbol/market_cap
 #@app.get("/data/symbol/market_cap")
@@ -432,18 +533,27 @@ async def get_symbol_roic_normalized(symbol: str):
 
 
 # Endpoint to generate a plot for a specific company
+# format=json returns the Plotly figure JSON for client-side rendering instead of HTML
 @app.get("/plot/{symbol}")
-def get_plot(symbol: str, metric: str):
-    query = f"""
+def get_plot(symbol: str, metric: str, format: str = "html"):
+    validate_symbol(symbol)
+    if format not in ("html", "json"):
+        raise HTTPException(status_code=400, detail="Invalid format. Use 'html' or 'json'.")
+
+    cache_key = ('plot', symbol, metric, format)
+    cached = response_cache.get(cache_key)
+    if cached is not MISSING:
+        return plot_response(cached, format)
+
+    # Use parameterized query to prevent SQL injection
+    query = """
         SELECT 
-            data->>'qfs_symbol_v2' AS symbol,
-            data->'financials'->'quarterly'->'{metric}' AS metric
+            symbol,
+            data->'financials'->'quarterly'->%s AS metric
         FROM companies
-        WHERE data->>'qfs_symbol_v2' = '{symbol}';
+        WHERE symbol = %s;
     """
-    print(f"Executing query: {query}")  # Debugging log
-    df = fetch_data(query)
-    print(f"Query result: {df}")  # Debugging log
+    df = fetch_data(query, (metric, symbol))
     
     if df.empty:
         return JSONResponse(content={"error": f"Data not found for symbol '{symbol}' and metric '{metric}'"}, status_code=404)
@@ -451,26 +561,95 @@ def get_plot(symbol: str, metric: str):
     # Ensure the metric data is parsed as a list
     data = df.iloc[0]['metric']
     if isinstance(data, str):
-        import json
         data = json.loads(data)  # Convert JSON string to Python list
     
     if not data:
         return JSONResponse(content={"error": f"No data available for metric '{metric}'"}, status_code=404)
     
-    plot_html = generate_plot(data, f"{symbol} {metric.capitalize()}")
-    return HTMLResponse(content=plot_html)
-
-#@app.get("/generate-report", response_class=FileResponse)
-#def generate_pdf_report():
-#    output_file = "financial_report.pdf"
-#    generate_report(output_file)
-#    return FileResponse(output_file, media_type="application/pdf", filename=output_file)
-#    return FileResponse(
-#        path=output_file,
-#        media_type="application/pdf",
-#        filename=output_file,
-#        as_attachment=False
-#    )
+    plot = render_plot(symbol, metric, data, format)
+    response_cache.set(cache_key, plot)
+    return plot_response(plot, format)
+
+def plot_response(plot, format):
+    if format == 'json':
+        return Response(content=plot, media_type="application/json")
+    return HTMLResponse(content=plot)
+
+# Endpoint exposing connection pool metrics
+@app.get("/metrics/pool")
+def get_pool_metrics():
+    return JSONResponse(content={"sync": db.pool_stats(), "async": db.async_pool_stats()})
+
+# Endpoint exposing response cache counters
+@app.get("/cache/stats")
+def get_cache_stats():
+    return JSONResponse(content={
+        "responses": response_cache.stats(),
+        "figures": figure_cache.stats(),
+        "similarity": similarity_index.stats() if similarity_index is not None else None,
+        "listener": listener.stats() if listener is not None else None
+    })
+
+# Explicit invalidation, e.g. after loading new quarterly data without the notify trigger
+@app.post("/cache/invalidate")
+def invalidate_cache(symbol: Optional[str] = None):
+    if symbol is not None:
+        validate_symbol(symbol)
+    removed = response_cache.invalidate(symbol)
+    return JSONResponse(content={"invalidated": removed})
+
+# Request body of POST /reports: the report thresholds on the last-5-quarter averages
+class ReportRequest(BaseModel):
+    min_market_cap: float = 500_000_000.0
+    min_roic: float = 0.0
+
+# Endpoint to enqueue a PDF report build; the build runs in a worker process
+@app.post("/reports")
+def create_report(request: ReportRequest):
+    job = report_jobs.submit(request.model_dump())
+    return JSONResponse(content=job, status_code=202)
+
+# Endpoint returning the status and progress of a report job
+@app.get("/reports/{job_id}")
+def get_report(job_id: str):
+    job = report_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Report job {job_id} not found")
+    return JSONResponse(content=job)
+
+# Endpoint serving the PDF of a finished report job
+@app.get("/reports/{job_id}/pdf", response_class=FileResponse)
+def get_report_pdf(job_id: str):
+    job = report_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Report job {job_id} not found")
+    path = report_jobs.pdf_path(job_id)
+    if path is None:
+        raise HTTPException(status_code=409, detail=f"Report job {job_id} is {job['status']}")
+    return FileResponse(
+        path=path,
+        media_type="application/pdf",
+        filename="financial_report.pdf",
+        content_disposition_type="inline"
+    )
+
+# Endpoint returning the k symbols most similar to a symbol by DTW distance of the market cap
+# Runs in the threadpool: the first query of a reference computes its distances to all symbols
+@app.get("/similarity/{symbol}")
+def get_similarity(symbol: str, k: int = 10):
+    validate_symbol(symbol)
+    if not 1 <= k <= SIMILARITY_MAX_K:
+        raise HTTPException(status_code=400, detail=f"k must be between 1 and {SIMILARITY_MAX_K}.")
+    try:
+        index = get_similarity_index()
+    except ImportError as e:
+        raise HTTPException(status_code=503, detail=f"Similarity search is not available: {e}")
+    try:
+        results = index.top_k(symbol, k)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=e.args[0])
+    return JSONResponse(content={"ref_symbol": symbol, "quarters": SIMILARITY_QUARTERS, "results": results})
+
 # Run the FastAPI app
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8001)
@@ -5,15 +5,41 @@ Modules and Libraries:
 - `psycopg2`: For connecting to and querying the PostgreSQL database.
 - `pandas`: For data manipulation and analysis.
 - `dotenv`: For loading environment variables from a `.env` file.
-- `os`: For accessing environment variables."""
+- `os`: For accessing environment variables.
+- `concurrent.futures`: For rendering the charts of many companies in parallel worker processes.
+- `cache`: Content-addressed on-disk chart cache; a rerun only renders charts whose data changed.
+Charts are cached under a hash of the metric array, the chart title and the chart style, and the
+least recently used charts are evicted once the cache directory exceeds its size limit.
+After each build the cache hit rate and the time spent in every phase are printed.
+Only companies whose last-5-quarter average market cap and ROIC exceed --min-market-cap and
+--min-roic are read; PostgreSQL evaluates the thresholds on columns added by the schema
+migrations, apply them first with `python ../postgres/migrate.py`.
+Usage:
+    python report.py --output financial_report.pdf --workers 4 --cache-dir chart_cache --cache-max-mb 512
+    python report.py --min-market-cap 1e9 --min-roic 0.1
+For universe-wide reports, --stream fetches the companies through a server-side cursor in chunks
+and writes the report as parts of --part-size companies (financial_report.part001.pdf, ...),
+so memory use stays flat however many companies qualify:
+    python report.py --stream --chunk-size 500 --part-size 300"""
 
 import psycopg2
 import pandas as pd
 from dotenv import load_dotenv
 import os
+import io
+import argparse
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import partial
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 from fpdf import FPDF
+from classify import THRESHOLD, item_colors
+from cache import DiskLRUCache
 
 # Load environment variables
 load_dotenv()
@@ -24,19 +50,41 @@ POSTGRES_DB = os.getenv('POSTGRES_DB', 'mydatabase')
 POSTGRES_HOST = os.getenv('POSTGRES_HOST', 'localhost')
 POSTGRES_PORT = os.getenv('POSTGRES_PORT', '5432')
 
-# Function to fetch data from PostgreSQL
-def fetch_data(query):
-    conn = psycopg2.connect(
+CHART_CACHE_DIR = os.getenv('CHART_CACHE_DIR', 'chart_cache')
+CHART_CACHE_MAX_MB = int(os.getenv('CHART_CACHE_MAX_MB', '512'))
+
+# Everything besides data and title that changes the rendered PNG; part of every cache key,
+# bump the version when generate_plot changes
+CHART_STYLE = f"bar;figsize=6x4;png;threshold={THRESHOLD};v1"
+
+# Function to open a PostgreSQL connection
+def get_db_connection():
+    return psycopg2.connect(
         dbname=POSTGRES_DB,
         user=POSTGRES_USER,
         password=POSTGRES_PASSWORD,
         host=POSTGRES_HOST,
         port=POSTGRES_PORT
     )
-    df = pd.read_sql(query, conn)
+
+# Function to fetch data from PostgreSQL
+def fetch_data(query, params=None):
+    conn = get_db_connection()
+    df = pd.read_sql(query, conn, params=params)
     conn.close()
     return df
 
+# Function to stream rows from PostgreSQL through a server-side cursor, `chunk_size` rows per round trip
+def stream_data(query, params=None, chunk_size=500):
+    conn = get_db_connection()
+    try:
+        with conn.cursor(name='report_rows') as cursor:
+            cursor.itersize = chunk_size
+            cursor.execute(query, params)
+            yield from cursor
+    finally:
+        conn.close()
+
 # Function to categorize companies based on pattern
 def categorize_company(data):
     avg_change = np.mean(np.diff(data))
@@ -48,109 +96,250 @@ def categorize_company(data):
         return 'Cluster 2: Cyclical patterns'
 
 # Function to get color for each value based on percentage change
+# The -7% classification is shared with the advisor, see classify.py
 def get_item_color(data):
-    colors = []
-    for i in range(len(data)):
-        if i == 0:  # No previous value for the first item
-            colors.append('blue')  # Default color for the first item
-        else:
-            if data[i - 1] == 0:
-                change = 0
-            else:
-                change = (data[i] - data[i - 1]) / data[i - 1] * 100  # Percentage change
-            if data[i] < 0:
-                change = -100  # Negative change
-#the percentage of 7 is used because a drop below is a sell signal (red = sell)
-            if change > 0:
-                colors.append('green')  # Positive change
-            elif -7 <= change <= 0:
-                colors.append('orange')  # Small negative or no change
-            elif change < -7:
-                colors.append('red')  # Large negative change
-        
-            #if data[i] < 0:  # Negative values should always be red
-            #    colors.append('red')
-    return colors
+    return item_colors(data)
+
+# Figure and axes reused for every chart rendered in this process
+_figure = None
+
+def get_figure():
+    global _figure
+    if _figure is None:
+        _figure = Figure(figsize=(6, 4))
+        FigureCanvasAgg(_figure)
+        _figure.add_subplot()
+    return _figure
 
 # Function to generate plots and save them as images
+# filename can also be a file-like object, e.g. io.BytesIO
 def generate_plot(data, title, filename):
-    plt.figure(figsize=(6, 4))
+    fig = get_figure()
+    ax = fig.axes[0]
+    ax.clear()
     colors = get_item_color(data)
-    plt.bar([f"Q{i+1}" for i in range(len(data))], data, color=colors)
-    plt.title(title)
-    plt.tight_layout()
-    plt.savefig(filename)
-    plt.close()
+    ax.bar([f"Q{i+1}" for i in range(len(data))], data, color=colors)
+    ax.set_title(title)
+    fig.tight_layout()
+    fig.savefig(filename, format='png')
 
-# Function to generate PDF report
-def generate_pdf(df, output_file):
+# Function to compute the content address of a chart
+def chart_key(data, title):
+    values = np.asarray(data if data is not None else [], dtype=float)
+    return DiskLRUCache.key(CHART_STYLE, title, values.tobytes())
+
+# Function to render the three charts of one company, returns the PNG bytes
+# Runs in the worker processes of generate_pdf; charts found in the cache are not rendered
+# Returns (images, cache hits, seconds spent rendering)
+def render_company_charts(company, cache=None):
+    symbol, revenue, market_cap, roic = company[:4]
+    images = []
+    hits = 0
+    render_time = 0.0
+    for data, label in ((revenue, 'Revenue'), (market_cap, 'Market Cap'), (roic, 'ROIC')):
+        title = f"{symbol} {label}"
+        key = chart_key(data, title) if cache is not None else None
+        image = cache.get(key) if cache is not None else None
+        if image is not None:
+            hits += 1
+        else:
+            start = time.perf_counter()
+            buffer = io.BytesIO()
+            generate_plot(data, title, buffer)
+            image = buffer.getvalue()
+            render_time += time.perf_counter() - start
+            if cache is not None:
+                cache.set(key, image)
+        images.append(image)
+    return images, hits, render_time
+
+# Function to render all charts, in order, over a process pool
+# companies can be a lazy iterator; at most a few companies per worker are in flight,
+# so rows are pulled from it as the charts are consumed
+# Yields (company, (images, cache hits, render seconds)); workers=0 renders in the current process
+def render_all_charts(companies, workers=None, cache=None):
+    render = partial(render_company_charts, cache=cache)
+    if workers == 0:
+        for company in companies:
+            yield company, render(company)
+        return
+    window = 4 * (workers or os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for company in companies:
+            pending.append((company, executor.submit(render, company)))
+            if len(pending) >= window:
+                company, future = pending.popleft()
+                yield company, future.result()
+        while pending:
+            company, future = pending.popleft()
+            yield company, future.result()
+
+# Function to time a phase of the report build, accumulated into timings[name]
+@contextmanager
+def phase(timings, name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+
+# Function to create an empty PDF document
+def new_pdf():
     pdf = FPDF()
     pdf.set_auto_page_break(auto=True, margin=15)
-    
-    for page_start in range(0, len(df), 3):  # Process 3 companies per page
-        pdf.add_page()
-        pdf.set_font("Arial", size=12)
-        
-        for index, row in df.iloc[page_start:page_start + 3].iterrows():
-            pdf.cell(200, 10, txt=f"Company: {row['symbol']}", ln=True, align='L')
-            pdf.cell(200, 10, txt=f"Sector: {row['sector']}", ln=True, align='L')
-            
-            # Generate and add revenue plot
-            revenue_plot = f"revenue_{index}.png"
-            generate_plot(row['revenue'], f"{row['symbol']} Revenue", revenue_plot)
-            
-            # Generate and add market cap plot
-            market_cap_plot = f"market_cap_{index}.png"
-            generate_plot(row['market_cap'], f"{row['symbol']} Market Cap", market_cap_plot)
-            
-            # Generate and add ROIC plot
-            roic_plot = f"roic_{index}.png"
-            generate_plot(row['roic'], f"{row['symbol']} ROIC", roic_plot)
-            
-            # Add images side by side
-            pdf.cell(200, 10, txt="Financial Metrics:", ln=True, align='L')
-            pdf.image(revenue_plot, x=10, y=pdf.get_y(), w=60)  # Revenue plot on the left
-            pdf.image(market_cap_plot, x=75, y=pdf.get_y(), w=60)  # Market cap plot in the middle
-            pdf.image(roic_plot, x=140, y=pdf.get_y(), w=60)  # ROIC plot on the right
-            pdf.ln(65)  # Adjust line height after adding images
-            
-            # Clean up plot images
-            os.remove(revenue_plot)
-            os.remove(market_cap_plot)
-            os.remove(roic_plot)
-        
-        # Add spacing between groups of companies
-        pdf.ln(10)
-    
-    pdf.output(output_file)
+    return pdf
+
+# Function to add companies from the `charts` iterator of render_all_charts to the PDF, 3 per page
+# Stops when the iterator is exhausted or `limit` companies were added; returns the number added
+# progress(done, total) is called after every page; total is None when the row count is unknown
+def add_company_pages(pdf, charts, stats, timings, limit=None, progress=None):
+    added = 0
+    while limit is None or added < limit:
+        with phase(timings, 'charts'):
+            page = list(islice(charts, 3 if limit is None else min(3, limit - added)))
+        if not page:
+            break
+
+        with phase(timings, 'layout'):
+            pdf.add_page()
+            pdf.set_font("helvetica", size=12)
+
+            for (symbol, _, _, _, sector), (images, hits, render_time) in page:
+                pdf.cell(200, 10, text=f"Company: {symbol}", new_x="LMARGIN", new_y="NEXT", align='L')
+                pdf.cell(200, 10, text=f"Sector: {sector}", new_x="LMARGIN", new_y="NEXT", align='L')
+
+                # Revenue, market cap and ROIC plots, rendered by the pool in row order
+                stats["charts"] += len(images)
+                stats["hits"] += hits
+                stats["render_seconds"] += render_time
+                revenue_plot, market_cap_plot, roic_plot = (io.BytesIO(image) for image in images)
+
+                # Add images side by side
+                pdf.cell(200, 10, text="Financial Metrics:", new_x="LMARGIN", new_y="NEXT", align='L')
+                pdf.image(revenue_plot, x=10, y=pdf.get_y(), w=60)  # Revenue plot on the left
+                pdf.image(market_cap_plot, x=75, y=pdf.get_y(), w=60)  # Market cap plot in the middle
+                pdf.image(roic_plot, x=140, y=pdf.get_y(), w=60)  # ROIC plot on the right
+                pdf.ln(65)  # Adjust line height after adding images
+
+            # Add spacing between groups of companies
+            pdf.ln(10)
+        added += len(page)
+        stats["companies"] += len(page)
+        if progress is not None:
+            progress(stats["companies"], stats.get("total"))
+    return added
+
+# Function to generate PDF report
+# Returns chart statistics; phase timings are added to `timings`
+def generate_pdf(df, output_file, workers=None, cache=None, timings=None, progress=None):
+    timings = {} if timings is None else timings
+    stats = {"companies": 0, "total": len(df), "charts": 0, "hits": 0, "render_seconds": 0.0}
+
+    companies = df[['symbol', 'revenue', 'market_cap', 'roic', 'sector']].itertuples(index=False, name=None)
+    pdf = new_pdf()
+    add_company_pages(pdf, render_all_charts(companies, workers, cache), stats, timings, progress=progress)
+
+    with phase(timings, 'write'):
+        pdf.output(output_file)
+    return stats
+
+# Function to get the file name of a PDF part, financial_report.pdf -> financial_report.part001.pdf
+def part_file_name(output_file, number):
+    base, ext = os.path.splitext(output_file)
+    return f"{base}.part{number:03d}{ext or '.pdf'}"
+
+# Function to generate the PDF report as parts of at most `companies_per_part` companies
+# rows is an iterator of (symbol, revenue, market_cap, roic, sector) tuples, e.g. from stream_data;
+# only one part and the charts in flight are held in memory
+# Returns chart statistics and the list of part files; phase timings are added to `timings`
+def generate_pdf_parts(rows, output_file, workers=None, cache=None, timings=None, companies_per_part=300,
+                       progress=None):
+    timings = {} if timings is None else timings
+    stats = {"companies": 0, "total": None, "charts": 0, "hits": 0, "render_seconds": 0.0}
+    charts = render_all_charts(rows, workers, cache)
+    parts = []
+    while True:
+        pdf = new_pdf()
+        if not add_company_pages(pdf, charts, stats, timings, limit=companies_per_part, progress=progress):
+            break
+        part_file = part_file_name(output_file, len(parts) + 1)
+        with phase(timings, 'write'):
+            pdf.output(part_file)
+        parts.append(part_file)
+    return stats, parts
+
+# Function to print the cache hit rate and the build time per phase
+def print_build_report(stats, timings):
+    charts = stats["charts"]
+    hit_rate = stats["hits"] / charts if charts else 0.0
+    print(f"charts: {charts}, cache hits: {stats['hits']} ({hit_rate:.1%}), rendered: {charts - stats['hits']}")
+    print(f"render time (all workers): {stats['render_seconds']:.2f}s")
+    for name, seconds in timings.items():
+        print(f"{name:<8} {seconds:8.2f}s")
+    print(f"{'total':<8} {sum(timings.values()):8.2f}s")
 
 # Main function
 def main():
-    generate_report()
+    parser = argparse.ArgumentParser(description="Generate the financial PDF report")
+    parser.add_argument("--output", default="financial_report.pdf", help="PDF file to write")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Processes rendering charts (default: number of CPUs, 0: no pool)")
+    parser.add_argument("--cache-dir", default=CHART_CACHE_DIR, help="Directory of the chart cache")
+    parser.add_argument("--cache-max-mb", type=int, default=CHART_CACHE_MAX_MB,
+                        help="Size limit of the chart cache in MB")
+    parser.add_argument("--no-cache", action="store_true", help="Render every chart, bypassing the cache")
+    parser.add_argument("--min-market-cap", type=float, default=500_000_000,
+                        help="Minimum average market cap over the last 5 quarters")
+    parser.add_argument("--min-roic", type=float, default=0, help="Minimum average ROIC over the last 5 quarters")
+    parser.add_argument("--stream", action="store_true",
+                        help="Stream companies from a server-side cursor and write the report in parts")
+    parser.add_argument("--chunk-size", type=int, default=500, help="Rows fetched per round trip in streaming mode")
+    parser.add_argument("--part-size", type=int, default=300, help="Companies per PDF part in streaming mode")
+    args = parser.parse_args()
+    cache = None if args.no_cache else DiskLRUCache(args.cache_dir, args.cache_max_mb * 1024 * 1024)
+    generate_report(args.output, workers=args.workers, cache=cache,
+                    min_market_cap=args.min_market_cap, min_roic=args.min_roic,
+                    stream=args.stream, chunk_size=args.chunk_size, companies_per_part=args.part_size)
 
-def generate_report(output_file="financial_report.pdf"):
+# Returns the written PDF files: [output_file], or the parts in streaming mode
+# progress(done, total) is called after every page, e.g. to report the state of a report job
+def generate_report(output_file="financial_report.pdf", workers=None, cache=None,
+                    min_market_cap=500_000_000, min_roic=0,
+                    stream=False, chunk_size=500, companies_per_part=300, progress=None):
+    timings = {}
+    # Companies are filtered on minimum thresholds in PostgreSQL, on the averages of the
+    # last 5 quarters stored by migrations/004_last5_averages.sql
     query = """
         SELECT 
-            data->>'qfs_symbol_v2' AS symbol,
-            data->'financials'->'quarterly'->'revenue' AS revenue,
-            data->'financials'->'quarterly'->'market_cap' AS market_cap,
-            data->'financials'->'quarterly'->'roic' AS roic,
+            symbol,
+            revenue,
+            market_cap,
+            roic,
             data->'metadata'->>'sector' AS sector
-        FROM companies;
+        FROM companies
+        WHERE market_cap_last5_avg > %(min_market_cap)s
+          AND roic_last5_avg > %(min_roic)s;
     """
-    
-    df = fetch_data(query)
-    
-    # Filter companies based on minimum thresholds
-    min_market_cap = 500_000_000  # Example threshold
-    min_roic = 0  # Example threshold
-    df = df[
-        df['market_cap'].apply(lambda x: np.mean(x[-5:]) > min_market_cap) &  # Last 5 values of market_cap
-        df['roic'].apply(lambda x: np.mean(x[-5:]) > min_roic)  # Last 5 values of roic
-    ]
-    
-    # Generate PDF report
-    generate_pdf(df, output_file)
+    params = {"min_market_cap": min_market_cap, "min_roic": min_roic}
+
+    if stream:
+        # Rows are fetched while the charts are rendered, so the query time is part of 'charts'
+        rows = stream_data(query, params, chunk_size)
+        stats, files = generate_pdf_parts(rows, output_file, workers=workers, cache=cache, timings=timings,
+                                          companies_per_part=companies_per_part, progress=progress)
+    else:
+        with phase(timings, 'query'):
+            df = fetch_data(query, params)
+
+        # Generate PDF report
+        stats = generate_pdf(df, output_file, workers=workers, cache=cache, timings=timings, progress=progress)
+        files = [output_file]
+    if cache is not None:
+        with phase(timings, 'prune'):
+            cache.prune()
+    print_build_report(stats, timings)
+    return files
 
 if __name__ == "__main__":
     main()
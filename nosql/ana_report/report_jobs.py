@@ -0,0 +1,206 @@
+"""
+This module runs PDF report builds (`report.generate_report`) as background jobs for the
+FastAPI app, so a build of several minutes never blocks API requests.
+
+Jobs run in a process pool; every job renders its charts with its own chart workers and the
+shared on-disk chart cache. The pool and the manager are started with 'spawn', the app process
+is multi-threaded and a forked child could inherit a lock held by another thread. Progress is reported through a multiprocessing manager dict, after
+every page of the PDF. Finished reports are cached: a job for the same filters returns the
+existing job (queued, running or done) until `invalidate()` is called, e.g. when the
+`companies_changed` notification reports new data.
+Job states: queued -> running -> done | failed.
+The PDF of a job is deleted when it fails or when a newer job for the same filters replaces it.
+Finished jobs are forgotten, with their PDF, after `max_age` seconds or when more than
+`max_jobs` finished jobs are kept, oldest first.
+Classes:
+- ReportJobs(directory, workers, chart_workers, cache_dir, cache_max_bytes, max_jobs, max_age):
+  Report job queue.
+    - start() / stop(): Create and shut down the process pool; stop() cancels queued jobs and
+      waits for running builds.
+    - submit(params): Enqueues a build for the filters in `params`, or returns the cached job.
+    - get(job_id): Returns the job status, or None for an unknown job.
+    - pdf_path(job_id): Returns the PDF file of a finished job, or None.
+    - invalidate(): Forgets the cached reports, so the next submit rebuilds them.
+"""
+
+import hashlib
+import json
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from cache import DiskLRUCache
+from report import generate_report
+
+
+# Function to record the progress of a job, called in the worker process
+def record_progress(progress, job_id, started_at, done, total):
+    progress[job_id] = (started_at, done, total)
+
+
+# Function to build one report, runs in a worker process of ReportJobs
+def build_report(output_file, params, chart_workers, cache_dir, cache_max_bytes, progress, job_id):
+    started_at = time.time()
+    record_progress(progress, job_id, started_at, 0, None)
+    cache = DiskLRUCache(cache_dir, cache_max_bytes)
+    tmp_file = f"{output_file}.tmp"
+    try:
+        generate_report(tmp_file, workers=chart_workers, cache=cache,
+                        progress=partial(record_progress, progress, job_id, started_at), **params)
+        os.replace(tmp_file, output_file)
+    finally:
+        remove_file(tmp_file)
+    return output_file
+
+
+# Function to delete a file that may not exist
+def remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class ReportJobs:
+    def __init__(self, directory, workers=1, chart_workers=2, cache_dir='chart_cache',
+                 cache_max_bytes=512 * 1024 * 1024, max_jobs=100, max_age=24 * 3600.0):
+        self.directory = directory
+        self.workers = workers
+        self.chart_workers = chart_workers
+        self.cache_dir = cache_dir
+        self.cache_max_bytes = cache_max_bytes
+        self.max_jobs = max_jobs
+        self.max_age = max_age
+        self._jobs = {}
+        self._by_key = {}
+        self._lock = threading.Lock()
+        self._executor = None
+        self._manager = None
+        self._progress = None
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        context = multiprocessing.get_context('spawn')
+        self._manager = context.Manager()
+        self._progress = self._manager.dict()
+        self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+
+    def stop(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+        if self._manager is not None:
+            self._manager.shutdown()
+            self._manager = None
+            self._progress = None
+
+    @staticmethod
+    def key(params):
+        return hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+    def submit(self, params):
+        key = self.key(params)
+        with self._lock:
+            job_id = self._by_key.get(key)
+            if job_id is not None and self._jobs[job_id]["status"] != "failed":
+                return self._status(self._jobs[job_id])
+
+            self._evict()
+            job_id = uuid.uuid4().hex
+            job = {
+                "id": job_id,
+                "key": key,
+                "status": "queued",
+                "params": params,
+                "file": os.path.join(self.directory, f"{job_id}.pdf"),
+                "created_at": time.time(),
+                "started_at": None,
+                "finished_at": None,
+                "error": None,
+            }
+            self._jobs[job_id] = job
+            self._by_key[key] = job_id
+            self._remove_superseded(key)
+            future = self._executor.submit(
+                build_report, job["file"], params, self.chart_workers, self.cache_dir,
+                self.cache_max_bytes, self._progress, job_id
+            )
+            future.add_done_callback(lambda f: self._finish(job_id, f))
+            return self._status(job)
+
+    def _finish(self, job_id, future):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job["finished_at"] = time.time()
+            if future.cancelled():
+                job["status"], job["error"] = "failed", "cancelled"
+            elif future.exception() is not None:
+                job["status"], job["error"] = "failed", str(future.exception())
+            else:
+                job["status"] = "done"
+            if job["status"] == "failed":
+                remove_file(job["file"])
+            self._remove_superseded(job["key"])
+            self._evict()
+
+    # Delete the finished jobs of a key that a newer job replaces; called with the lock held
+    def _remove_superseded(self, key):
+        current = self._by_key.get(key)
+        if current is None:
+            return
+        for job in list(self._jobs.values()):
+            if job["key"] == key and job["id"] != current and job["finished_at"] is not None:
+                self._forget(job)
+
+    # Forget finished jobs that are too old or too many, oldest first; called with the lock held
+    def _evict(self):
+        finished = sorted((job for job in self._jobs.values() if job["finished_at"] is not None),
+                          key=lambda job: job["finished_at"])
+        now = time.time()
+        excess = len(finished) - self.max_jobs
+        for job in finished:
+            if excess > 0 or now - job["finished_at"] > self.max_age:
+                self._forget(job)
+                excess -= 1
+
+    def _forget(self, job):
+        remove_file(job["file"])
+        del self._jobs[job["id"]]
+        if self._by_key.get(job["key"]) == job["id"]:
+            del self._by_key[job["key"]]
+        if self._progress is not None:
+            self._progress.pop(job["id"], None)
+
+    def _status(self, job):
+        started_at, done, total = None, 0, None
+        if self._progress is not None:
+            started_at, done, total = self._progress.get(job["id"], (None, 0, None))
+        if started_at is not None:
+            job["started_at"] = started_at
+            if job["status"] == "queued":
+                job["status"] = "running"
+        status = {key: value for key, value in job.items() if key not in ("file", "key")}
+        status["progress"] = {"companies": done, "total": total}
+        return status
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return self._status(job) if job is not None else None
+
+    def pdf_path(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job["status"] != "done":
+                return None
+            return job["file"]
+
+    def invalidate(self):
+        with self._lock:
+            self._by_key.clear()
@@ -99,10 +99,10 @@ async def check_pattern(symbol: str):
     # Query market_cap data
     query = """
     SELECT
-        data->>'qfs_symbol_v2' AS symbol,
-        COALESCE(data->'financials'->'quarterly'->'market_cap', '[]'::jsonb) AS market_cap
+        symbol,
+        market_cap
     FROM companies
-    WHERE data->>'qfs_symbol_v2' = %s;
+    WHERE symbol = %s;
     """
     try:
         df = fetch_data(query, params=(symbol,))
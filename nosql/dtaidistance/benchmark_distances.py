@@ -0,0 +1,67 @@
+"""
+This script checks the DTW engine of distances.py against the per-pair `dtw.distance_fast`
+loop of calculate-and-store3.py and times both on synthetic standardized series.
+
+The series are random walks of `--quarters` quarters, standardized like the market caps of the
+DTW job; the first series is the reference. Every engine variant runs once:
+- loop: one dtw.distance_fast call per candidate
+- blocks: distances_to_reference without a process pool
+- blocks + OpenMP: the same with dtaidistance's OpenMP threads
+- pool: distances_to_reference over a process pool, for every value of --workers
+The script exits with an error when any distance differs from the loop result.
+
+Usage:
+    python benchmark_distances.py --series 10000 --quarters 65 --workers 2 4 8
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+from dtaidistance import dtw
+
+from distances import distances_to_reference
+
+
+def synthetic_series(n_series, n_quarters, seed=0):
+    rng = np.random.default_rng(seed)
+    values = np.cumprod(1 + rng.normal(0.01, 0.08, (n_series, n_quarters)), axis=1)
+    return (values - values.mean(axis=1, keepdims=True)) / values.std(axis=1, keepdims=True)
+
+
+def main(n_series, n_quarters, workers, block_size):
+    series = synthetic_series(n_series, n_quarters)
+    reference, candidates = series[0], series[1:]
+
+    start = time.perf_counter()
+    expected = np.array([dtw.distance_fast(reference, candidate) for candidate in candidates])
+    loop_time = time.perf_counter() - start
+
+    variants = [("blocks", dict(workers=0)), ("blocks + OpenMP", dict(workers=0, parallel=True))]
+    variants += [(f"pool workers={n}", dict(workers=n)) for n in workers]
+
+    print(f"{len(candidates)} candidates x {n_quarters} quarters, {os.cpu_count()} CPUs")
+    print(f"  {'loop':<22} {loop_time:8.3f}s")
+    failed = False
+    for name, options in variants:
+        start = time.perf_counter()
+        computed = distances_to_reference(reference, candidates, block_size=block_size, **options)
+        elapsed = time.perf_counter() - start
+        identical = np.array_equal(computed, expected)
+        failed |= not identical
+        print(f"  {name:<22} {elapsed:8.3f}s -> {loop_time / elapsed:5.1f}x faster than the loop"
+              f"{'' if identical else '   DISTANCES DIFFER'}")
+    if failed:
+        raise SystemExit("distances differ from the loop")
+    print("all distances identical")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check and benchmark the parallel DTW engine")
+    parser.add_argument("--series", type=int, default=10000, help="Number of synthetic series")
+    parser.add_argument("--quarters", type=int, default=65, help="Quarters per series")
+    parser.add_argument("--workers", type=int, nargs="+", default=[2, 4], help="Process pool sizes")
+    parser.add_argument("--block-size", type=int, default=1000, help="Candidates per C call")
+    args = parser.parse_args()
+    main(args.series, args.quarters, args.workers, args.block_size)
@@ -0,0 +1,56 @@
+"""
+This script checks the pruned k-nearest-neighbour search of knn.py against computing the DTW
+distance to every candidate (distances.py) and reports how many DTW calls the lower bounds save.
+
+The series are random walks of `--quarters` quarters, standardized like the market caps of the
+DTW jobs; the first series is the reference. For every window the brute-force search and the
+pruned search run once. The script exits with an error when the k nearest distances differ.
+
+Usage:
+    python benchmark_knn.py --series 10000 --quarters 65 --k 50 --windows 4 8 16
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from benchmark_distances import synthetic_series
+from distances import distances_to_reference
+from knn import knn_search
+
+
+def main(n_series, n_quarters, k, windows):
+    series = synthetic_series(n_series, n_quarters)
+    reference, candidates = series[0], series[1:]
+
+    print(f"{len(candidates)} candidates x {n_quarters} quarters, k={k}")
+    failed = False
+    for window in windows:
+        start = time.perf_counter()
+        expected = np.sort(distances_to_reference(reference, candidates, workers=0, window=window))[:k]
+        brute_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        indices, distances, stats = knn_search(reference, candidates, k, window)
+        knn_time = time.perf_counter() - start
+
+        identical = np.allclose(distances, expected, rtol=0, atol=1e-12)
+        failed |= not identical
+        print(f"  window={window}: brute force {brute_time:.3f}s, pruned {knn_time:.3f}s "
+              f"-> {brute_time / knn_time:.1f}x; {stats['dtw_calls']} DTW calls ({stats['abandoned']} abandoned), "
+              f"pruned {stats['pruned_lb_kim']} by LB_Kim and {stats['pruned_lb_keogh']} by LB_Keogh, "
+              f"pruning rate {stats['pruning_rate']:.1%}{'' if identical else '   DISTANCES DIFFER'}")
+    if failed:
+        raise SystemExit("nearest distances differ from the brute-force search")
+    print("all nearest distances identical")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check and benchmark the pruned DTW k-NN search")
+    parser.add_argument("--series", type=int, default=10000, help="Number of synthetic series")
+    parser.add_argument("--quarters", type=int, default=65, help="Quarters per series")
+    parser.add_argument("--k", type=int, default=50, help="Number of nearest series")
+    parser.add_argument("--windows", type=int, nargs="+", default=[4, 8, 16], help="Sakoe-Chiba windows")
+    args = parser.parse_args()
+    main(args.series, args.quarters, args.k, args.windows)
@@ -5,6 +5,11 @@ import pandas as pd
 import numpy as np
 from dtaidistance import dtw
 import json
+import sys
+
+# The bulk upsert is shared with the other batch writers, see ana_report/bulk.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ana_report'))
+from bulk import upsert_rows
 
 # Load environment variables
 load_dotenv()
@@ -63,14 +68,9 @@ def store_distances(distances):
     conn = get_db_connection()
     try:
         cursor = conn.cursor()
-        insert_query = """
-        INSERT INTO distance2DEZ (symbol, distance)
-        VALUES (%s, %s)
-        ON CONFLICT (symbol) DO UPDATE
-        SET distance = EXCLUDED.distance;
-        """
-        for symbol, distance in distances.items():
-            cursor.execute(insert_query, (symbol, distance))
+        # One INSERT ... ON CONFLICT per batch instead of one per symbol
+        upsert_rows(cursor, 'distance2DEZ', ['symbol', 'distance'],
+                    ((symbol, distance) for symbol, distance in distances.items()))
         conn.commit()
     except Exception as e:
         conn.rollback()
@@ -82,9 +82,9 @@ def store_distances(distances):
 # Fetch all unique symbols
 def get_all_symbols() -> list:
     query = """
-    SELECT DISTINCT data->>'qfs_symbol_v2' AS symbol
+    SELECT DISTINCT symbol
     FROM companies
-    WHERE data->>'qfs_symbol_v2' IS NOT NULL;
+    WHERE symbol IS NOT NULL;
     """
     df = fetch_data(query)
     return df['symbol'].tolist()
@@ -93,10 +93,10 @@ def get_all_symbols() -> list:
 def get_stock_data(symbol: str, start_date: str = '2008-01-01', end_date: str = '2025-06-30') -> pd.DataFrame:
     query = """
     SELECT
-        data->>'qfs_symbol_v2' AS symbol,
-        COALESCE(data->'financials'->'quarterly'->'market_cap', '[]'::jsonb) AS market_cap
+        symbol,
+        market_cap
     FROM companies
-    WHERE data->>'qfs_symbol_v2' = %s;
+    WHERE symbol = %s;
     """
     df = fetch_data(query, (symbol,))
     return df
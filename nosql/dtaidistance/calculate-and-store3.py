@@ -1,11 +1,15 @@
+import argparse
 import os
 from dotenv import load_dotenv
 import psycopg2
-import pandas as pd
-import numpy as np
-from dtaidistance import dtw
-import json
-from sqlalchemy import create_engine
+import sys
+import time
+
+# The bulk upsert is shared with the other batch writers, see ana_report/bulk.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ana_report'))
+from bulk import upsert_rows
+from distances import distances_to_reference
+from series_store import SERIES_STORE_DIR, open_store, refresh_store
 
 # Load environment variables
 load_dotenv()
@@ -16,11 +20,7 @@ POSTGRES_DB = os.getenv('POSTGRES_DB', 'mydatabase')
 POSTGRES_HOST = os.getenv('POSTGRES_HOST', 'localhost')
 POSTGRES_PORT = os.getenv('POSTGRES_PORT', '5432')
 
-# Create SQLAlchemy engine
-DATABASE_URL = f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
-engine = create_engine(DATABASE_URL)
-
-# Database connection function for psycopg2 (used for non-pandas operations)
+# Database connection function
 def get_db_connection():
     try:
         conn = psycopg2.connect(
@@ -34,14 +34,6 @@ def get_db_connection():
     except Exception as e:
         raise Exception(f"Database connection error: {str(e)}")
 
-# Fetch data from database using SQLAlchemy
-def fetch_data(query, params=None):
-    try:
-        df = pd.read_sql(query, engine, params=params)
-        return df
-    except Exception as e:
-        raise Exception(f"Error fetching data: {str(e)}")
-
 # Create distance2DEZ table
 def create_distance_table():
     conn = get_db_connection()
@@ -67,14 +59,9 @@ def store_distances(distances):
     conn = get_db_connection()
     try:
         cursor = conn.cursor()
-        insert_query = """
-        INSERT INTO distance2DEZ (symbol, distance)
-        VALUES (%s, %s)
-        ON CONFLICT (symbol) DO UPDATE
-        SET distance = EXCLUDED.distance;
-        """
-        for symbol, distance in distances.items():
-            cursor.execute(insert_query, (symbol, float(distance)))  # Ensure distance is float
+        # One INSERT ... ON CONFLICT per batch instead of one per symbol
+        upsert_rows(cursor, 'distance2DEZ', ['symbol', 'distance'],
+                    ((symbol, float(distance)) for symbol, distance in distances.items()))
         conn.commit()
     except Exception as e:
         conn.rollback()
@@ -83,85 +70,32 @@ def store_distances(distances):
         cursor.close()
         conn.close()
 
-# Fetch all unique symbols
-def get_all_symbols() -> list:
-    query = """
-    SELECT DISTINCT data->>'qfs_symbol_v2' AS symbol
-    FROM companies
-    WHERE data->>'qfs_symbol_v2' IS NOT NULL;
-    """
-    df = fetch_data(query)
-    return df['symbol'].tolist()
-
-# Fetch stock data for a specific symbol
-def get_stock_data(symbol: str, start_date: str = '2008-01-01', end_date: str = '2025-06-30') -> pd.DataFrame:
-    query = """
-    SELECT
-        data->>'qfs_symbol_v2' AS symbol,
-        COALESCE(data->'financials'->'quarterly'->'market_cap', '[]'::jsonb) AS market_cap
-    FROM companies
-    WHERE data->>'qfs_symbol_v2' = %s;
-    """
-    df = fetch_data(query, (symbol,))
-    return df
-
 # Main function to calculate DTW distances and store in database
-def calculate_dtw_to_deutz(symbol='DEZ:DE', n_quarters=65):
-    # Step 1: Fetch Deutz market cap data
-    deutz_df = get_stock_data(symbol)
-    if deutz_df.empty:
-        raise ValueError(f"No data found for symbol {symbol}")
-    
-    # Parse market cap data (handle both JSON string and pre-parsed list)
-    market_cap_raw = deutz_df['market_cap'].iloc[0]
+def calculate_dtw_to_deutz(symbol='DEZ:DE', n_quarters=65, workers=None):
+    # Step 1: Refresh the standardized market caps of changed symbols in the series store
+    start = time.perf_counter()
+    conn = get_db_connection()
     try:
-        if isinstance(market_cap_raw, str):
-            deutz_market_cap = np.array(json.loads(market_cap_raw), dtype=float)
-        elif isinstance(market_cap_raw, list):
-            deutz_market_cap = np.array(market_cap_raw, dtype=float)
-        else:
-            raise ValueError(f"Unexpected market_cap type for {symbol}: {type(market_cap_raw)}")
-    except Exception as e:
-        raise ValueError(f"Error parsing market cap for {symbol}: {str(e)}")
-    
-    # Truncate to last n_quarters (65 for Deutz)
-    if len(deutz_market_cap) < n_quarters:
-        raise ValueError(f"Deutz market cap data has {len(deutz_market_cap)} quarters, need at least {n_quarters}")
-    deutz_market_cap = deutz_market_cap[-n_quarters:]  # Take last 65 quarters
+        stats = refresh_store(conn, SERIES_STORE_DIR, n_quarters)
+    finally:
+        conn.close()
+    print(f"refreshed {stats['changed']} of {stats['symbols']} symbols in {time.perf_counter() - start:.2f}s")
+
+    # Step 2: The last n_quarters (65 for Deutz) of every symbol with a full history, standardized
+    symbols, standardized = open_store(SERIES_STORE_DIR, n_quarters)
+    if symbol not in symbols:
+        raise ValueError(f"No market cap data of {n_quarters} quarters found for symbol {symbol}")
+    reference = symbols.index(symbol)
+    deutz_standardized = standardized[reference]
 
-    # Step 2: Fetch all symbols
-    all_symbols = get_all_symbols()
-    all_symbols = [s for s in all_symbols if s != symbol]  # Exclude Deutz
-    print ("fetched all symbols")
-    # Step 3: Calculate DTW distances
-    distances = {}
-    for sym in all_symbols:
-        df = get_stock_data(sym)
-        print ("symbol :", sym)
-        if df.empty:
-            print ("empty dataframe")
-            continue
-        try:
-            market_cap_raw = df['market_cap'].iloc[0]
-            if isinstance(market_cap_raw, str):
-                market_cap = np.array(json.loads(market_cap_raw), dtype=float)
-            elif isinstance(market_cap_raw, list):
-                market_cap = np.array(market_cap_raw, dtype=float)
-            else:
-                raise ValueError(f"Unexpected market_cap type for {sym}: {type(market_cap_raw)}")
-            # Ensure enough data and truncate to last n_quarters
-            if len(market_cap) < n_quarters:
-                continue
-            market_cap = market_cap[-n_quarters:]  # Take last 65 quarters
-            # Standardize data to make DTW scale-invariant
-            market_cap = (market_cap - np.mean(market_cap)) / np.std(market_cap) if np.std(market_cap) != 0 else market_cap
-            deutz_standardized = (deutz_market_cap - np.mean(deutz_market_cap)) / np.std(deutz_market_cap) if np.std(deutz_market_cap) != 0 else deutz_market_cap
-            # Calculate DTW distance
-            d = dtw.distance_fast(deutz_standardized, market_cap)
-            distances[sym] = d
-        except Exception as e:
-            print(f"Error processing {sym}: {str(e)}")
-            continue
+    # Step 3: Calculate DTW distances to every other symbol
+    # One C call per block of candidates instead of one per symbol, blocks spread over `workers` processes
+    candidates = [i for i in range(len(symbols)) if i != reference]
+    start = time.perf_counter()
+    values = distances_to_reference(deutz_standardized, standardized[candidates], workers=workers)
+    distances = dict(zip((symbols[i] for i in candidates), values))
+    print(f"calculated {len(distances)} distances in {time.perf_counter() - start:.2f}s, "
+          f"{stats['symbols'] - 1 - len(distances)} symbols skipped")
 
     # Step 4: Create distance2DEZ table
     create_distance_table()
@@ -171,7 +105,11 @@ def calculate_dtw_to_deutz(symbol='DEZ:DE', n_quarters=65):
 
 # Execute
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calculate the DTW distance of every symbol to DEZ:DE")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Processes computing the distances (default: number of CPUs, 0: no pool)")
+    args = parser.parse_args()
     try:
-        calculate_dtw_to_deutz('DEZ:DE', n_quarters=65)
+        calculate_dtw_to_deutz('DEZ:DE', n_quarters=65, workers=args.workers)
     except Exception as e:
         print(f"Error: {str(e)}")
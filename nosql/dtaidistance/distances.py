@@ -0,0 +1,49 @@
+"""
+This module computes the DTW distances from one reference series to many candidate series,
+for the dtaidistance jobs (calculate-and-store3.py, benchmark_distances.py).
+
+Calling `dtw.distance_fast` once per candidate costs a Python round trip per pair. Here the
+candidates are split in blocks of `block_size` series, and every block is a single call of
+dtaidistance's C routine `distance_matrix_fast`, restricted to the row of the reference.
+The blocks are spread over a process pool of `workers` processes; with workers=0 they run in
+this process. parallel=True also lets dtaidistance use its OpenMP threads within a block.
+`window` is the Sakoe-Chiba band of dtaidistance (None: unconstrained).
+The distances are identical to `dtw.distance_fast(reference, candidate, window=window)`.
+Functions:
+- block_distances(reference, series, parallel, window): Distances from reference to every row of series.
+- distances_to_reference(reference, series, workers, block_size, parallel, window): The same, block by
+  block over a process pool; returns a np.ndarray in the order of the rows.
+Usage:
+    from distances import distances_to_reference
+    distances = distances_to_reference(standardized[reference], standardized[candidates], workers=4)
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+from dtaidistance import dtw
+
+
+def block_distances(reference, series, parallel=False, window=None):
+    if len(series) == 0:
+        return np.empty(0)
+    stacked = np.vstack([reference, series])
+    # Only the first row of the distance matrix, from the reference to the rows of series
+    block = ((0, 1), (1, len(stacked)))
+    return np.asarray(dtw.distance_matrix_fast(stacked, block=block, compact=True, parallel=parallel,
+                                                window=window))
+
+
+def distances_to_reference(reference, series, workers=None, block_size=1000, parallel=False, window=None):
+    reference = np.ascontiguousarray(reference, dtype=float)
+    series = np.ascontiguousarray(series, dtype=float)
+    blocks = [series[start:start + block_size] for start in range(0, len(series), block_size)]
+    if workers == 0 or len(blocks) <= 1:
+        results = [block_distances(reference, block, parallel, window) for block in blocks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+            compute = partial(block_distances, reference, parallel=parallel, window=window)
+            results = list(executor.map(compute, blocks))
+    return np.concatenate(results) if results else np.empty(0)
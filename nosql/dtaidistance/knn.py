@@ -0,0 +1,175 @@
+"""
+This script finds the k symbols whose standardized market cap is closest to a reference symbol
+by DTW distance, without computing the DTW distance to every candidate.
+
+The DTW distance of dtaidistance is the square root of the summed squared differences along the
+warping path, constrained to a Sakoe-Chiba band of `window` quarters. Two cheap lower bounds of
+that distance are computed for all candidates at once:
+- LB_Kim: the path always aligns the first and the last quarters of both series.
+- LB_Keogh: every quarter of the candidate is at least as far from the envelope (running min/max
+  within the window) of the reference as from the quarter it is aligned with.
+The candidates are visited in the order of their lower bound. Once the lower bound of the next
+candidate reaches the k-th best distance found so far, it and all remaining ones are pruned.
+The DTW calls that remain abandon early (dtaidistance `max_dist`) as soon as the distance exceeds
+the k-th best distance. The result is the same as computing every distance.
+Functions:
+- envelope(series, window): Returns the lower and upper envelope of a series.
+- lb_kim(reference, series): LB_Kim of every row of series.
+- lb_keogh(reference, series, window): LB_Keogh of every row of series against the envelope of reference.
+- knn_search(reference, series, k, window): Returns the row indices and distances of the k nearest
+  rows, nearest first, and the pruning statistics.
+- main(symbol, k, window, n_quarters): Runs the search over the series store (series_store.py).
+
+Usage:
+    python knn.py --symbol DEZ:DE --k 50 --window 8
+"""
+
+import argparse
+import heapq
+import os
+import sys
+import time
+
+import numpy as np
+import psycopg2
+from dotenv import load_dotenv
+from dtaidistance import dtw
+
+from series_store import SERIES_STORE_DIR, open_store, refresh_store
+
+# Load environment variables
+load_dotenv()
+
+POSTGRES_USER = os.getenv('POSTGRES_USER', 'myuser')
+POSTGRES_PASSWORD = os.getenv('POSTGRES_PASSWORD', 'mypassword')
+POSTGRES_DB = os.getenv('POSTGRES_DB', 'mydatabase')
+POSTGRES_HOST = os.getenv('POSTGRES_HOST', 'localhost')
+POSTGRES_PORT = os.getenv('POSTGRES_PORT', '5432')
+
+
+# Function to compute the running minimum and maximum within the Sakoe-Chiba band
+# Quarter i of one series can be aligned with quarters i - window + 1 .. i + window - 1 of the other
+def envelope(series, window=None):
+    series = np.asarray(series, dtype=float)
+    n = len(series)
+    width = n if window is None else max(1, min(window, n))
+    padded_max = np.concatenate([np.full(width - 1, -np.inf), series, np.full(width - 1, -np.inf)])
+    padded_min = np.concatenate([np.full(width - 1, np.inf), series, np.full(width - 1, np.inf)])
+    windows = 2 * width - 1
+    lower = np.lib.stride_tricks.sliding_window_view(padded_min, windows).min(axis=1)
+    upper = np.lib.stride_tricks.sliding_window_view(padded_max, windows).max(axis=1)
+    return lower, upper
+
+
+# Function to compute LB_Kim (first and last quarter) of every candidate
+def lb_kim(reference, series):
+    first = (series[:, 0] - reference[0]) ** 2
+    if series.shape[1] == 1:
+        return np.sqrt(first)
+    return np.sqrt(first + (series[:, -1] - reference[-1]) ** 2)
+
+
+# Function to compute LB_Keogh of every candidate against the envelope of the reference
+def lb_keogh(reference, series, window=None):
+    lower, upper = envelope(reference, window)
+    above = np.maximum(series - upper, 0)
+    below = np.maximum(lower - series, 0)
+    return np.sqrt((above ** 2 + below ** 2).sum(axis=1))
+
+
+# Function to find the k nearest candidates with lower-bound pruning and early abandoning
+def knn_search(reference, series, k=50, window=None):
+    if k < 1:
+        raise ValueError("k must be at least 1")
+    # dtaidistance needs writable buffers: the reference and the visited rows of a read-only store are copied
+    reference = np.array(reference, dtype=float)
+    series = np.asarray(series, dtype=float)
+    kim = lb_kim(reference, series)
+    keogh = lb_keogh(reference, series, window)
+    bound = np.maximum(kim, keogh)
+    order = np.argsort(bound, kind='stable')
+
+    best = []  # Max-heap of the k best (-distance, index)
+    dtw_calls = 0
+    abandoned = 0
+    visited = 0
+    for i in order:
+        threshold = -best[0][0] if len(best) == k else np.inf
+        if bound[i] >= threshold:
+            break  # The bounds are sorted, no remaining candidate can be closer
+        visited += 1
+        # max_dist=None disables early abandoning; a threshold of 0 stops at the bound check above
+        distance = dtw.distance_fast(reference, np.array(series[i]), window=window,
+                                     max_dist=None if np.isinf(threshold) else threshold)
+        dtw_calls += 1
+        if np.isinf(distance):
+            abandoned += 1
+            continue
+        if len(best) < k:
+            heapq.heappush(best, (-distance, i))
+        elif distance < threshold:
+            heapq.heapreplace(best, (-distance, i))
+
+    best.sort(key=lambda item: (-item[0], item[1]))
+    indices = np.array([i for _, i in best], dtype=int)
+    distances = np.array([-d for d, _ in best])
+
+    # Attribute the pruned candidates to the cheapest bound that excluded them
+    threshold = distances[-1] if len(best) == k else np.inf
+    pruned = order[visited:]
+    pruned_kim = int((kim[pruned] >= threshold).sum())
+    candidates = len(series)
+    stats = {
+        "candidates": candidates,
+        "dtw_calls": dtw_calls,
+        "abandoned": abandoned,
+        "pruned_lb_kim": pruned_kim,
+        "pruned_lb_keogh": len(pruned) - pruned_kim,
+        "pruning_rate": round(1 - dtw_calls / candidates, 4) if candidates else 0.0,
+    }
+    return indices, distances, stats
+
+
+# Main function
+def main(symbol='DEZ:DE', k=50, window=8, n_quarters=65):
+    conn = psycopg2.connect(
+        user=POSTGRES_USER,
+        password=POSTGRES_PASSWORD,
+        host=POSTGRES_HOST,
+        port=POSTGRES_PORT,
+        database=POSTGRES_DB
+    )
+    try:
+        refresh_store(conn, SERIES_STORE_DIR, n_quarters)
+    finally:
+        conn.close()
+
+    symbols, standardized = open_store(SERIES_STORE_DIR, n_quarters)
+    if symbol not in symbols:
+        raise ValueError(f"No market cap history of {n_quarters} quarters for symbol {symbol}")
+    reference = standardized[symbols.index(symbol)]
+    candidates = np.array([i for i in range(len(symbols)) if symbols[i] != symbol], dtype=int)
+
+    start = time.perf_counter()
+    indices, distances, stats = knn_search(reference, standardized[candidates], k, window)
+    elapsed = time.perf_counter() - start
+
+    for i, distance in zip(indices, distances):
+        print(f"{symbols[candidates[i]]:<20} {distance:.4f}")
+    print(f"{stats['candidates']} candidates, {stats['dtw_calls']} DTW calls ({stats['abandoned']} abandoned), "
+          f"pruned {stats['pruned_lb_kim']} by LB_Kim and {stats['pruned_lb_keogh']} by LB_Keogh, "
+          f"pruning rate {stats['pruning_rate']:.1%}, {elapsed:.3f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find the k symbols closest to a symbol by DTW distance")
+    parser.add_argument("--symbol", default='DEZ:DE', help="Reference symbol")
+    parser.add_argument("--k", type=int, default=50, help="Number of nearest symbols")
+    parser.add_argument("--window", type=int, default=8, help="Sakoe-Chiba window in quarters")
+    parser.add_argument("--quarters", type=int, default=65, help="Number of last quarters compared")
+    args = parser.parse_args()
+    try:
+        main(args.symbol, args.k, args.window, args.quarters)
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        sys.exit(1)
@@ -0,0 +1,260 @@
+"""
+This module keeps a persisted store of the standardized market cap series for the DTW jobs
+(calculate-and-store3.py, knn.py and the similarity service of the FastAPI app).
+
+Loading and standardizing the market caps of all symbols on every run is replaced by these files
+per number of quarters in the store directory:
+- market_cap_<n>.<id>.npy: float64 matrix (symbols x n) of the standardized last n quarters of every
+  symbol with a full history. open_store memory-maps it read-only, so the jobs share the pages of
+  one file instead of each building their own copy.
+- market_cap_<n>.json: the index: the name of the current matrix, the symbol of every row and the
+  companies.quarterly_hash (postgres/migrations/005_quarterly_hash.sql) of every symbol the store
+  was built from, including the symbols with a short history.
+- market_cap_<n>.lock: serializes refreshes (flock), so concurrent jobs never write the same files.
+refresh_store compares the stored hashes with the database and only fetches and standardizes
+new and changed symbols. The unchanged rows are copied from the current matrix into a new file,
+and the index pointing to it is swapped in with os.replace: a mapped matrix is never written,
+so readers see either the old or the new store, never a half written one. Older matrices are
+deleted; processes that still map one keep reading it until they reopen the store.
+Environment Variables:
+- SERIES_STORE_DIR: Directory of the store (default "series_store" next to this module).
+Functions:
+- load_market_caps(conn, n_quarters, chunk_size, symbols): Fetches the last n_quarters of the market cap
+  of every symbol, or of the given symbols, in one streamed query; returns the symbols, a
+  (symbols x n_quarters) matrix aligned on the last quarter and its validity mask.
+- standardize(values): Standardizes every row; constant rows are left unchanged.
+- fetch_hashes(conn): Returns {symbol: quarterly_hash} of the last row of every symbol.
+- refresh_store(conn, directory, n_quarters, full): Brings the store up to date; returns counters.
+- open_store(directory, n_quarters): Returns the row symbols and the read-only memory-mapped matrix.
+The lock is POSIX flock, the jobs run on Linux.
+
+Usage:
+    python series_store.py --quarters 65          # refresh changed symbols
+    python series_store.py --quarters 65 --full   # rebuild the store
+"""
+
+import argparse
+import fcntl
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+
+import numpy as np
+import psycopg2
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+POSTGRES_USER = os.getenv('POSTGRES_USER', 'myuser')
+POSTGRES_PASSWORD = os.getenv('POSTGRES_PASSWORD', 'mypassword')
+POSTGRES_DB = os.getenv('POSTGRES_DB', 'mydatabase')
+POSTGRES_HOST = os.getenv('POSTGRES_HOST', 'localhost')
+POSTGRES_PORT = os.getenv('POSTGRES_PORT', '5432')
+SERIES_STORE_DIR = os.getenv('SERIES_STORE_DIR',
+                             os.path.join(os.path.dirname(os.path.abspath(__file__)), 'series_store'))
+
+
+# Fetch the last n_quarters of the market cap of every symbol in one streamed query
+# One row per symbol, the last one like correlation.py; the series are cut to n_quarters in PostgreSQL
+# Returns the symbols, a contiguous (symbols x n_quarters) matrix aligned on the last quarter
+# and its validity mask, which is False in front of histories shorter than n_quarters
+def load_market_caps(conn, n_quarters, chunk_size=1000, symbols=None):
+    query = """
+    SELECT DISTINCT ON (symbol)
+        symbol,
+        market_cap[greatest(cardinality(market_cap) - %(n_quarters)s + 1, 1):]
+    FROM companies
+    WHERE symbol IS NOT NULL{}
+    ORDER BY symbol, id DESC;
+    """.format(" AND symbol = ANY(%(symbols)s)" if symbols is not None else "")
+    params = {'n_quarters': n_quarters, 'symbols': list(symbols or [])}
+    symbols, blocks, masks = [], [], []
+    columns = np.arange(n_quarters)
+    with conn.cursor(name='market_caps') as cursor:
+        cursor.itersize = chunk_size
+        cursor.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            series = [market_cap or [] for _, market_cap in rows]
+            lengths = np.array([len(s) for s in series])
+            mask = columns[np.newaxis, :] >= n_quarters - lengths[:, np.newaxis]
+            block = np.full((len(rows), n_quarters), np.nan)
+            # The values of all rows in one flat array, scattered into the right-aligned slots
+            block[mask] = np.array([value for s in series for value in s], dtype=float)
+            symbols.extend(symbol for symbol, _ in rows)
+            blocks.append(block)
+            masks.append(mask)
+    conn.commit()
+    if not symbols:
+        return [], np.empty((0, n_quarters)), np.empty((0, n_quarters), dtype=bool)
+    return symbols, np.concatenate(blocks), np.concatenate(masks)
+
+
+# Standardize every row to make DTW scale-invariant; constant rows are left unchanged
+def standardize(values):
+    mean = values.mean(axis=-1, keepdims=True)
+    std = values.std(axis=-1, keepdims=True)
+    return np.where(std != 0, (values - mean) / np.where(std != 0, std, 1), values)
+
+
+# Function to return the index and lock file of a store
+# The matrix file name is recorded in the index, every refresh writes a new one
+def store_paths(directory, n_quarters):
+    base = os.path.join(directory, f"market_cap_{n_quarters}")
+    return f"{base}.json", f"{base}.lock"
+
+
+# Function to hold the lock of a store: exclusive for refresh_store, shared for open_store
+@contextmanager
+def store_lock(directory, n_quarters, exclusive):
+    with open(store_paths(directory, n_quarters)[1], 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+# Function to fetch the quarterly hash of every symbol, the last row like load_market_caps
+def fetch_hashes(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT DISTINCT ON (symbol) symbol, quarterly_hash
+            FROM companies
+            WHERE symbol IS NOT NULL
+            ORDER BY symbol, id DESC;
+        """)
+        hashes = dict(cursor.fetchall())
+    conn.commit()
+    return hashes
+
+
+# Function to read the index of a store, None when there is no store yet
+def read_index(directory, n_quarters):
+    index_path = store_paths(directory, n_quarters)[0]
+    if not os.path.exists(index_path):
+        return None
+    with open(index_path) as f:
+        index = json.load(f)
+    if not os.path.exists(os.path.join(directory, index['matrix'])):
+        return None
+    return index
+
+
+# Function to create a new, uniquely named file in the store directory
+def new_file(directory, n_quarters, suffix):
+    fd, path = tempfile.mkstemp(dir=directory, prefix=f"market_cap_{n_quarters}.", suffix=suffix)
+    os.close(fd)
+    return path
+
+
+# Function to bring the store up to date with the companies table
+# Writers are serialized by the store lock; the matrix is always written to a new file and the
+# index is swapped in with os.replace, so readers see either the old or the new store
+def refresh_store(conn, directory=SERIES_STORE_DIR, n_quarters=65, full=False):
+    os.makedirs(directory, exist_ok=True)
+    with store_lock(directory, n_quarters, exclusive=True):
+        hashes = fetch_hashes(conn)
+        index = None if full else read_index(directory, n_quarters)
+        old_hashes = index['hashes'] if index is not None else {}
+        old_symbols = index['symbols'] if index is not None else []
+
+        changed = [symbol for symbol, digest in hashes.items() if old_hashes.get(symbol) != digest]
+        removed = [symbol for symbol in old_hashes if symbol not in hashes]
+        stats = {"symbols": len(hashes), "rows": len(old_symbols), "changed": len(changed),
+                 "removed": len(removed)}
+        if index is not None and not changed and not removed:
+            return stats
+
+        # Fetch and standardize only the new and changed symbols
+        rows = {}
+        if changed:
+            symbols, market_caps, valid = load_market_caps(conn, n_quarters, symbols=changed)
+            complete = valid.all(axis=1)
+            complete_symbols = [symbol for symbol, keep in zip(symbols, complete) if keep]
+            rows = dict(zip(complete_symbols, standardize(market_caps[complete])))
+
+        dropped = set(changed) | set(removed)
+        kept = [symbol for symbol in old_symbols if symbol not in dropped]
+        new_symbols = sorted(kept + list(rows))
+
+        old_matrix = read_matrix(directory, index) if index is not None else None
+        old_positions = {symbol: i for i, symbol in enumerate(old_symbols)}
+        matrix_path = new_file(directory, n_quarters, '.npy')
+        index_path = new_file(directory, n_quarters, '.json.tmp')
+        try:
+            matrix = np.lib.format.open_memmap(matrix_path, mode='w+', dtype=np.float64,
+                                               shape=(len(new_symbols), n_quarters))
+            for i, symbol in enumerate(new_symbols):
+                matrix[i] = rows[symbol] if symbol in rows else old_matrix[old_positions[symbol]]
+            matrix.flush()
+            del matrix
+            with open(index_path, 'w') as f:
+                json.dump({"n_quarters": n_quarters, "matrix": os.path.basename(matrix_path),
+                           "symbols": new_symbols, "hashes": hashes}, f)
+            os.replace(index_path, store_paths(directory, n_quarters)[0])
+        except BaseException:
+            for path in (matrix_path, index_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            raise
+
+        # Earlier matrices and files left by interrupted refreshes; mapped files stay readable until unmapped
+        for name in os.listdir(directory):
+            if name.startswith(f"market_cap_{n_quarters}.") and name != os.path.basename(matrix_path) \
+                    and (name.endswith('.npy') or name.endswith('.tmp')):
+                os.remove(os.path.join(directory, name))
+
+    stats["rows"] = len(new_symbols)
+    return stats
+
+
+# Function to map the matrix of an index read-only
+def read_matrix(directory, index):
+    n_quarters = index['n_quarters']
+    if not index['symbols']:
+        return np.empty((0, n_quarters))
+    matrix = np.load(os.path.join(directory, index['matrix']), mmap_mode='r')
+    if matrix.shape != (len(index['symbols']), n_quarters):
+        raise ValueError(f"Series store {directory} does not match its index, run refresh_store with full=True")
+    return matrix
+
+
+# Function to open the store without copying: the rows are read from the memory-mapped file on access
+def open_store(directory=SERIES_STORE_DIR, n_quarters=65):
+    with store_lock(directory, n_quarters, exclusive=False):
+        index = read_index(directory, n_quarters)
+        if index is None:
+            raise FileNotFoundError(f"No series store for {n_quarters} quarters in {directory}, "
+                                    f"run refresh_store first")
+        return index['symbols'], read_matrix(directory, index)
+
+
+# Main function
+def main(n_quarters=65, full=False, directory=SERIES_STORE_DIR):
+    conn = psycopg2.connect(
+        user=POSTGRES_USER,
+        password=POSTGRES_PASSWORD,
+        host=POSTGRES_HOST,
+        port=POSTGRES_PORT,
+        database=POSTGRES_DB
+    )
+    try:
+        stats = refresh_store(conn, directory, n_quarters, full=full)
+    finally:
+        conn.close()
+    print(f"{stats['symbols']} symbols, {stats['rows']} series of {n_quarters} quarters stored; "
+          f"{stats['changed']} changed, {stats['removed']} removed")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Refresh the store of standardized market cap series")
+    parser.add_argument("--quarters", type=int, default=65, help="Number of last quarters stored")
+    parser.add_argument("--full", action="store_true", help="Rebuild the store instead of refreshing changed symbols")
+    parser.add_argument("--dir", default=SERIES_STORE_DIR, help="Store directory")
+    args = parser.parse_args()
+    main(args.quarters, full=args.full, directory=args.dir)
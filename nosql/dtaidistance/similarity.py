@@ -0,0 +1,135 @@
+"""
+This module keeps the standardized market cap series of all companies in memory and answers
+"which symbols are most similar to X" by DTW distance, for any reference symbol.
+
+It generalizes calculate-and-store3.py, which only compares against DEZ:DE and stores the
+result in distance2DEZ. The standardized last `n_quarters` of every symbol with a full history
+are read from the series store (series_store.py), which is refreshed for changed symbols first
+and memory-mapped instead of copied. The distances
+of a reference to all other symbols are computed with distances.py, written to the
+dtw_similarity table (postgres/migrations/006_dtw_similarity.sql) and cached, so repeated
+queries for the same reference only sort. `invalidate()` marks the series stale, e.g. when the
+`companies_changed` notification reports new data; the next query refreshes the store and reloads them.
+Functions:
+- store_similarity(conn, ref_symbol, symbols, distances): Replaces the rows of a reference in dtw_similarity.
+Classes:
+- SimilarityIndex(connection, n_quarters, workers, max_references, cache_ttl, directory): In-memory
+  similarity search. `connection` returns a context manager yielding a psycopg2 connection, like
+  db.connection; `directory` is the series store.
+    - load(): Refreshes the series store, maps the series and clears the cached references.
+    - invalidate(): Reloads the series at the next query.
+    - top_k(ref_symbol, k): Returns the k symbols closest to ref_symbol as
+      [{"symbol": ..., "distance": ...}], nearest first; KeyError for an unknown or too short symbol.
+    - stats(): Returns the number of resident series and the reference cache counters.
+"""
+
+import os
+import sys
+import threading
+
+import numpy as np
+
+from distances import distances_to_reference
+from series_store import SERIES_STORE_DIR, open_store, refresh_store
+
+# The bulk upsert and the caches are shared with ana_report
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ana_report'))
+from bulk import upsert_rows
+from cache import TTLCache, MISSING
+
+
+# Replace the distances of one reference in dtw_similarity
+def store_similarity(conn, ref_symbol, symbols, distances):
+    with conn.cursor() as cursor:
+        cursor.execute("DELETE FROM dtw_similarity WHERE ref_symbol = %s;", (ref_symbol,))
+        upsert_rows(cursor, 'dtw_similarity', ['ref_symbol', 'symbol', 'distance'],
+                    ((ref_symbol, symbol, float(distance)) for symbol, distance in zip(symbols, distances)),
+                    key_columns=('ref_symbol', 'symbol'))
+    conn.commit()
+
+
+class SimilarityIndex:
+    def __init__(self, connection, n_quarters=65, workers=0, max_references=256, cache_ttl=3600.0,
+                 directory=SERIES_STORE_DIR):
+        self.connection = connection
+        self.directory = directory
+        self.n_quarters = n_quarters
+        self.workers = workers
+        # Distances per reference, dropped when the series are reloaded
+        self._references = TTLCache(maxsize=max_references, ttl=cache_ttl)
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._state = None
+        self._generation = 0
+        self._loaded_generation = None
+
+    def load(self):
+        with self._load_lock:
+            self._load()
+
+    # Called with _load_lock held, so only one thread refreshes the store and maps the series
+    # The generation is read before the store: a notification that arrives during the load
+    # bumps it again, so the new state is stale right away and the next query reloads
+    def _load(self):
+        with self._lock:
+            generation = self._generation
+        with self.connection() as conn:
+            refresh_store(conn, self.directory, self.n_quarters)
+        symbols, series = open_store(self.directory, self.n_quarters)
+        positions = {symbol: i for i, symbol in enumerate(symbols)}
+        with self._lock:
+            self._state = (symbols, positions, series)
+            self._loaded_generation = generation
+            self._references.invalidate()
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+
+    def _is_stale(self):
+        return self._state is None or self._loaded_generation != self._generation
+
+    def _current(self):
+        with self._lock:
+            if not self._is_stale():
+                return self._state
+        with self._load_lock:
+            # Another request may have reloaded while this one waited for the lock
+            with self._lock:
+                stale = self._is_stale()
+            if stale:
+                self._load()
+        with self._lock:
+            return self._state
+
+    def top_k(self, ref_symbol, k=10):
+        state = self._current()
+        symbols, positions, series = state
+        if ref_symbol not in positions:
+            raise KeyError(f"No market cap history of {self.n_quarters} quarters for symbol {ref_symbol}")
+        position = positions[ref_symbol]
+
+        cache_key = ('dtw', ref_symbol)
+        distances = self._references.get(cache_key)
+        if distances is MISSING:
+            distances = distances_to_reference(series[position], series, workers=self.workers)
+            distances[position] = np.inf  # The reference itself is no candidate
+            others = [i for i in range(len(symbols)) if i != position]
+            with self.connection() as conn:
+                store_similarity(conn, ref_symbol, [symbols[i] for i in others], distances[others])
+            # Only cache results of the series they were computed from
+            with self._lock:
+                if self._state is state:
+                    self._references.set(cache_key, distances)
+
+        k = min(k, len(symbols) - 1)
+        nearest = np.argpartition(distances, k - 1)[:k] if k > 0 else np.empty(0, dtype=int)
+        nearest = nearest[np.argsort(distances[nearest], kind='stable')]
+        return [{"symbol": symbols[i], "distance": float(distances[i])} for i in nearest]
+
+    def stats(self):
+        with self._lock:
+            resident = len(self._state[0]) if self._state is not None else 0
+            stale = self._is_stale()
+        return {"series": resident, "quarters": self.n_quarters, "stale": stale,
+                "references": self._references.stats()}
@@ -0,0 +1,136 @@
+"""
+This script benchmarks symbol lookups on a synthetic companies table, before and after adding the
+generated symbol column, its index and the native quarterly arrays from
+migrations/003_symbol_and_quarterly_arrays.sql.
+
+A `companies_bench` table with the same JSONB layout as `companies` is filled with synthetic
+companies (65 quarters of revenue, market_cap and roic each, with the occasional "N/A" or null
+quarter like the scraped data has), then random symbol lookups are timed:
+- before: WHERE data->>'qfs_symbol_v2' = %s, reading the market_cap JSONB array
+- after:  WHERE symbol = %s, reading the market_cap double precision[] column
+The table is dropped afterwards. Run `python migrate.py` first, the benchmark uses the
+jsonb_to_float8_array function created by migration 003.
+
+Usage:
+    python benchmark_symbol_index.py --companies 50000 --lookups 2000
+"""
+import argparse
+import json
+import os
+import random
+import time
+
+import psycopg2
+from psycopg2.extras import execute_values
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+POSTGRES_USER = os.getenv('POSTGRES_USER', 'myuser')
+POSTGRES_PASSWORD = os.getenv('POSTGRES_PASSWORD', 'mypassword')
+POSTGRES_DB = os.getenv('POSTGRES_DB', 'mydatabase')
+POSTGRES_HOST = os.getenv('POSTGRES_HOST', 'localhost')
+POSTGRES_PORT = os.getenv('POSTGRES_PORT', '5432')
+
+N_QUARTERS = 65
+
+# Share of quarters that are not numbers, the generated columns must not fail on them
+MISSING_RATE = 0.01
+
+
+def synthetic_company(i):
+    def series(start, drift):
+        values = [start]
+        for _ in range(N_QUARTERS - 1):
+            values.append(round(values[-1] * (1 + random.gauss(drift, 0.08)), 4))
+        return [random.choice(["N/A", None]) if random.random() < MISSING_RATE else v for v in values]
+
+    return {
+        "qfs_symbol_v2": f"SYN{i}:DE",
+        "metadata": {"sector": random.choice(["Industrials", "Technology", "Consumer Discretionary"])},
+        "financials": {
+            "quarterly": {
+                "revenue": series(random.uniform(1e7, 1e9), 0.01),
+                "market_cap": series(random.uniform(1e8, 1e10), 0.01),
+                "roic": series(random.uniform(0.01, 0.3), 0.0),
+            }
+        },
+    }
+
+
+def time_lookups(cursor, query, symbols):
+    start = time.perf_counter()
+    for symbol in symbols:
+        cursor.execute(query, (symbol,))
+        cursor.fetchall()
+    return time.perf_counter() - start
+
+
+def main(n_companies, n_lookups):
+    conn = psycopg2.connect(
+        user=POSTGRES_USER,
+        password=POSTGRES_PASSWORD,
+        host=POSTGRES_HOST,
+        port=POSTGRES_PORT,
+        database=POSTGRES_DB
+    )
+    cursor = conn.cursor()
+    try:
+        cursor.execute("DROP TABLE IF EXISTS companies_bench;")
+        cursor.execute("CREATE TABLE companies_bench (id SERIAL PRIMARY KEY, data JSONB);")
+        print(f"inserting {n_companies} synthetic companies ...")
+        execute_values(
+            cursor,
+            "INSERT INTO companies_bench (data) VALUES %s;",
+            ((json.dumps(synthetic_company(i)),) for i in range(n_companies)),
+            page_size=1000
+        )
+        cursor.execute("ANALYZE companies_bench;")
+        conn.commit()
+
+        symbols = [f"SYN{random.randrange(n_companies)}:DE" for _ in range(n_lookups)]
+
+        before = time_lookups(cursor, """
+            SELECT data->>'qfs_symbol_v2' AS symbol,
+                   COALESCE(data->'financials'->'quarterly'->'market_cap', '[]'::jsonb) AS market_cap
+            FROM companies_bench
+            WHERE data->>'qfs_symbol_v2' = %s;
+        """, symbols)
+
+        start = time.perf_counter()
+        cursor.execute("""
+            ALTER TABLE companies_bench
+                ADD COLUMN symbol text GENERATED ALWAYS AS (data->>'qfs_symbol_v2') STORED,
+                ADD COLUMN market_cap double precision[]
+                    GENERATED ALWAYS AS (jsonb_to_float8_array(data->'financials'->'quarterly'->'market_cap')) STORED;
+        """)
+        cursor.execute("CREATE INDEX ON companies_bench (symbol);")
+        cursor.execute("ANALYZE companies_bench;")
+        conn.commit()
+        migration = time.perf_counter() - start
+
+        after = time_lookups(cursor, """
+            SELECT symbol, market_cap
+            FROM companies_bench
+            WHERE symbol = %s;
+        """, symbols)
+
+        print(f"migration on {n_companies} rows: {migration:.2f}s")
+        print(f"before: {n_lookups} lookups in {before:.2f}s ({before / n_lookups * 1000:.3f} ms/lookup)")
+        print(f"after:  {n_lookups} lookups in {after:.2f}s ({after / n_lookups * 1000:.3f} ms/lookup)")
+        print(f"speedup: {before / after:.1f}x")
+    finally:
+        conn.rollback()
+        cursor.execute("DROP TABLE IF EXISTS companies_bench;")
+        conn.commit()
+        cursor.close()
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark symbol lookups with and without the symbol index")
+    parser.add_argument("--companies", type=int, default=50000, help="Number of synthetic companies")
+    parser.add_argument("--lookups", type=int, default=2000, help="Number of random symbol lookups")
+    args = parser.parse_args()
+    main(args.companies, args.lookups)
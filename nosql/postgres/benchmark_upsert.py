@@ -0,0 +1,106 @@
+"""
+This script benchmarks the bulk upsert of ana_report/bulk.py against the per-row
+`INSERT ... ON CONFLICT` loops it replaces in the batch writers.
+
+Two synthetic tables with the layouts of the real result tables are written:
+- distance2dez_bench: (symbol, distance), like distance2DEZ and symbomodel
+- company_correlation_bench: codes arrays plus correlations, like company_correlation
+Every table is written twice, once into an empty table (inserts) and once over the existing rows
+(updates), with the loop and with upsert_rows at several batch sizes. The tables are dropped afterwards.
+
+Usage:
+    python benchmark_upsert.py --rows 20000 --batch-sizes 100 1000 5000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+import psycopg2
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ana_report'))
+from bulk import upsert_rows
+
+# Load environment variables
+load_dotenv()
+
+POSTGRES_USER = os.getenv('POSTGRES_USER', 'myuser')
+POSTGRES_PASSWORD = os.getenv('POSTGRES_PASSWORD', 'mypassword')
+POSTGRES_DB = os.getenv('POSTGRES_DB', 'mydatabase')
+POSTGRES_HOST = os.getenv('POSTGRES_HOST', 'localhost')
+POSTGRES_PORT = os.getenv('POSTGRES_PORT', '5432')
+
+TABLES = {
+    'distance2dez_bench': (
+        "symbol VARCHAR(50) PRIMARY KEY, distance FLOAT",
+        ['symbol', 'distance'],
+        lambda i: (f"SYN{i}:DE", random.uniform(0, 100)),
+    ),
+    'company_correlation_bench': (
+        "symbol TEXT PRIMARY KEY, revenue INTEGER[], market_cap INTEGER[], roic INTEGER[], "
+        "correlation_all FLOAT, consecutive_ones INT",
+        ['symbol', 'revenue', 'market_cap', 'roic', 'correlation_all', 'consecutive_ones'],
+        lambda i: (f"SYN{i}:DE", [random.choice((-1, 0, 1)) for _ in range(65)],
+                   [random.choice((-1, 0, 1)) for _ in range(65)], [random.choice((-1, 0, 1)) for _ in range(65)],
+                   random.random(), random.randrange(20)),
+    ),
+}
+
+
+def loop_upsert(cursor, table, columns, rows):
+    updates = ", ".join(f"{column} = EXCLUDED.{column}" for column in columns[1:])
+    query = (f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))}) "
+             f"ON CONFLICT (symbol) DO UPDATE SET {updates};")
+    for row in rows:
+        cursor.execute(query, row)
+
+
+def timed(conn, write, rows):
+    start = time.perf_counter()
+    write(rows)
+    conn.commit()
+    return len(rows) / (time.perf_counter() - start)
+
+
+def main(n_rows, batch_sizes):
+    conn = psycopg2.connect(
+        user=POSTGRES_USER,
+        password=POSTGRES_PASSWORD,
+        host=POSTGRES_HOST,
+        port=POSTGRES_PORT,
+        database=POSTGRES_DB
+    )
+    cursor = conn.cursor()
+    try:
+        for table, (definition, columns, make_row) in TABLES.items():
+            rows = [make_row(i) for i in range(n_rows)]
+            writers = [("loop", lambda rows: loop_upsert(cursor, table, columns, rows))]
+            for batch_size in batch_sizes:
+                writers.append((f"upsert_rows batch={batch_size}",
+                                lambda rows, b=batch_size: upsert_rows(cursor, table, columns, rows, batch_size=b)))
+
+            print(f"{table}: {n_rows} rows")
+            for name, write in writers:
+                cursor.execute(f"DROP TABLE IF EXISTS {table}; CREATE TABLE {table} ({definition});")
+                conn.commit()
+                inserts = timed(conn, write, rows)
+                updates = timed(conn, write, rows)
+                print(f"  {name:<26} inserts {inserts:10.0f} rows/s   updates {updates:10.0f} rows/s")
+    finally:
+        conn.rollback()
+        for table in TABLES:
+            cursor.execute(f"DROP TABLE IF EXISTS {table};")
+        conn.commit()
+        cursor.close()
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the bulk upsert against per-row upserts")
+    parser.add_argument("--rows", type=int, default=20000, help="Rows written per run")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[100, 1000, 5000],
+                        help="Batch sizes of upsert_rows")
+    args = parser.parse_args()
+    main(args.rows, args.batch_sizes)
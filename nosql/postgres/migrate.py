@@ -0,0 +1,90 @@
+"""
+This script applies the SQL schema migrations in the `migrations` directory to the PostgreSQL database.
+
+Migrations are plain `.sql` files named `NNN_description.sql` and are applied in file name order.
+Applied migrations are recorded in the `schema_migrations` table, so running the script again only
+applies new files. Each migration runs in its own transaction.
+
+Environment Variables:
+    - POSTGRES_USER, POSTGRES_PASSWORD, POSTGRES_DB, POSTGRES_HOST, POSTGRES_PORT
+
+Usage:
+    python migrate.py            # apply pending migrations
+    python migrate.py --list     # show applied and pending migrations
+"""
+import argparse
+import os
+
+import psycopg2
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+POSTGRES_USER = os.getenv('POSTGRES_USER', 'myuser')
+POSTGRES_PASSWORD = os.getenv('POSTGRES_PASSWORD', 'mypassword')
+POSTGRES_DB = os.getenv('POSTGRES_DB', 'mydatabase')
+POSTGRES_HOST = os.getenv('POSTGRES_HOST', 'localhost')
+POSTGRES_PORT = os.getenv('POSTGRES_PORT', '5432')
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
+
+def get_db_connection():
+    return psycopg2.connect(
+        user=POSTGRES_USER,
+        password=POSTGRES_PASSWORD,
+        host=POSTGRES_HOST,
+        port=POSTGRES_PORT,
+        database=POSTGRES_DB
+    )
+
+
+def available_migrations():
+    return sorted(f for f in os.listdir(MIGRATIONS_DIR) if f.endswith('.sql'))
+
+
+def applied_migrations(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version TEXT PRIMARY KEY,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+    """)
+    cursor.execute("SELECT version FROM schema_migrations;")
+    return {row[0] for row in cursor.fetchall()}
+
+
+def migrate(list_only=False):
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        applied = applied_migrations(cursor)
+        conn.commit()
+        for name in available_migrations():
+            if name in applied:
+                print(f"applied  {name}")
+                continue
+            if list_only:
+                print(f"pending  {name}")
+                continue
+            with open(os.path.join(MIGRATIONS_DIR, name)) as f:
+                sql = f.read()
+            try:
+                cursor.execute(sql)
+                cursor.execute("INSERT INTO schema_migrations (version) VALUES (%s);", (name,))
+                conn.commit()
+                print(f"applying {name} ... done")
+            except Exception as e:
+                conn.rollback()
+                raise Exception(f"Error applying migration {name}: {str(e)}")
+        cursor.close()
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply SQL schema migrations")
+    parser.add_argument("--list", action="store_true", help="List applied and pending migrations")
+    args = parser.parse_args()
+    migrate(list_only=args.list)
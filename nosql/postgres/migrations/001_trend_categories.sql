@@ -0,0 +1,32 @@
+-- Trend categories for GET /data, computed once per row instead of on every request.
+--
+-- The category is the sign of the mean quarter-over-quarter change. The mean of the
+-- differences telescopes to (last - first) / (n - 1), so only the first and last
+-- values are needed. Series with fewer than two values are 'Cluster 2'. The category is
+-- NULL (unknown) when the first or last value is not a number, e.g. null or "N/A".
+CREATE OR REPLACE FUNCTION trend_category(series jsonb)
+RETURNS text
+LANGUAGE sql
+IMMUTABLE
+AS $$
+    SELECT CASE
+        WHEN jsonb_typeof(series) IS DISTINCT FROM 'array' OR jsonb_array_length(series) < 2
+            THEN 'Cluster 2: Cyclical patterns'
+        WHEN jsonb_typeof(series->-1) IS DISTINCT FROM 'number' OR jsonb_typeof(series->0) IS DISTINCT FROM 'number'
+            THEN NULL
+        WHEN (series->-1)::double precision > (series->0)::double precision
+            THEN 'Cluster 1: Steady growth'
+        WHEN (series->-1)::double precision < (series->0)::double precision
+            THEN 'Cluster 3: Declining'
+        ELSE 'Cluster 2: Cyclical patterns'
+    END
+$$;
+
+-- Stored generated columns are recomputed by PostgreSQL whenever a row's data changes
+ALTER TABLE companies
+    ADD COLUMN IF NOT EXISTS revenue_category text
+        GENERATED ALWAYS AS (trend_category(data->'financials'->'quarterly'->'revenue')) STORED,
+    ADD COLUMN IF NOT EXISTS market_cap_category text
+        GENERATED ALWAYS AS (trend_category(data->'financials'->'quarterly'->'market_cap')) STORED,
+    ADD COLUMN IF NOT EXISTS roic_category text
+        GENERATED ALWAYS AS (trend_category(data->'financials'->'quarterly'->'roic')) STORED;
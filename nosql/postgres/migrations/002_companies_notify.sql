@@ -0,0 +1,33 @@
+-- Notify listeners when company data changes, so caches can drop stale entries.
+--
+-- Row changes send the affected symbol on the 'companies_changed' channel;
+-- TRUNCATE sends an empty payload, meaning "everything changed".
+CREATE OR REPLACE FUNCTION notify_companies_changed()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        PERFORM pg_notify('companies_changed', '');
+        RETURN NULL;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.data->>'qfs_symbol_v2' IS NOT NULL THEN
+        PERFORM pg_notify('companies_changed', OLD.data->>'qfs_symbol_v2');
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.data->>'qfs_symbol_v2' IS NOT NULL
+       AND NEW.data->>'qfs_symbol_v2' IS DISTINCT FROM OLD.data->>'qfs_symbol_v2' THEN
+        PERFORM pg_notify('companies_changed', NEW.data->>'qfs_symbol_v2');
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS companies_changed ON companies;
+CREATE TRIGGER companies_changed
+    AFTER INSERT OR UPDATE OR DELETE ON companies
+    FOR EACH ROW EXECUTE FUNCTION notify_companies_changed();
+
+DROP TRIGGER IF EXISTS companies_truncated ON companies;
+CREATE TRIGGER companies_truncated
+    AFTER TRUNCATE ON companies
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_companies_changed();
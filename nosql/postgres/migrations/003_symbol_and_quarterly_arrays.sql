@@ -0,0 +1,39 @@
+-- Indexed symbol lookups and native quarterly arrays for the companies table.
+--
+-- Every service filters on data->>'qfs_symbol_v2', which without an index is a
+-- sequential scan that detoasts each JSONB document. The symbol is extracted into
+-- an indexed generated column, and the quarterly series used for computations are
+-- extracted into double precision[] columns, so readers no longer parse JSON.
+-- Missing series become empty arrays, like COALESCE(..., '[]'::jsonb) did. Elements
+-- that are not numbers (null, "N/A", ...) become NULL instead of failing the cast.
+CREATE OR REPLACE FUNCTION jsonb_to_float8_array(series jsonb)
+RETURNS double precision[]
+LANGUAGE sql
+IMMUTABLE
+AS $$
+    SELECT CASE
+        WHEN jsonb_typeof(series) = 'array' THEN ARRAY(
+            SELECT CASE WHEN jsonb_typeof(value) = 'number' THEN value::double precision END
+            FROM jsonb_array_elements(series) WITH ORDINALITY AS t(value, position)
+            ORDER BY position
+        )
+        ELSE '{}'::double precision[]
+    END
+$$;
+
+ALTER TABLE companies
+    ADD COLUMN IF NOT EXISTS symbol text
+        GENERATED ALWAYS AS (data->>'qfs_symbol_v2') STORED,
+    ADD COLUMN IF NOT EXISTS revenue double precision[]
+        GENERATED ALWAYS AS (jsonb_to_float8_array(data->'financials'->'quarterly'->'revenue')) STORED,
+    ADD COLUMN IF NOT EXISTS market_cap double precision[]
+        GENERATED ALWAYS AS (jsonb_to_float8_array(data->'financials'->'quarterly'->'market_cap')) STORED,
+    ADD COLUMN IF NOT EXISTS roic double precision[]
+        GENERATED ALWAYS AS (jsonb_to_float8_array(data->'financials'->'quarterly'->'roic')) STORED;
+
+CREATE INDEX IF NOT EXISTS companies_symbol_idx ON companies (symbol);
+
+-- Queries that still filter on the JSONB expression can use this index
+CREATE INDEX IF NOT EXISTS companies_qfs_symbol_v2_idx ON companies ((data->>'qfs_symbol_v2'));
+
+ANALYZE companies;
@@ -0,0 +1,33 @@
+-- Averages of the last five quarters, used by the report thresholds.
+--
+-- report.py selects companies whose average market cap and ROIC over the last five
+-- quarters exceed a minimum. Storing both averages as indexed generated columns lets
+-- PostgreSQL evaluate the thresholds, so only qualifying rows are sent to the report.
+-- Like np.mean, the average is NULL (never qualifying) for an empty series or a series
+-- with a missing value among its last n quarters. Values that are not numbers, such as
+-- "N/A", count as missing.
+CREATE OR REPLACE FUNCTION jsonb_tail_avg(series jsonb, n integer)
+RETURNS double precision
+LANGUAGE sql
+IMMUTABLE
+AS $$
+    SELECT CASE
+        WHEN jsonb_typeof(series) = 'array' THEN (
+            SELECT CASE WHEN count(number) = count(*) THEN avg(number) END
+            FROM jsonb_array_elements(series) WITH ORDINALITY AS t(value, position),
+                LATERAL (SELECT CASE WHEN jsonb_typeof(value) = 'number' THEN value::double precision END) AS v(number)
+            WHERE position > jsonb_array_length(series) - n
+        )
+    END
+$$;
+
+ALTER TABLE companies
+    ADD COLUMN IF NOT EXISTS market_cap_last5_avg double precision
+        GENERATED ALWAYS AS (jsonb_tail_avg(data->'financials'->'quarterly'->'market_cap', 5)) STORED,
+    ADD COLUMN IF NOT EXISTS roic_last5_avg double precision
+        GENERATED ALWAYS AS (jsonb_tail_avg(data->'financials'->'quarterly'->'roic', 5)) STORED;
+
+-- The market cap threshold is the selective one: most listed companies are small
+CREATE INDEX IF NOT EXISTS companies_market_cap_last5_avg_idx ON companies (market_cap_last5_avg);
+
+ANALYZE companies;
@@ -0,0 +1,13 @@
+-- Content hash of the quarterly series, for incremental batch jobs.
+--
+-- advisor/correlation.py stores the hash it computed from in company_correlation and
+-- only recomputes companies whose revenue, market_cap or roic series changed since.
+-- The hash is taken over the JSONB text of the three series; a missing series hashes
+-- as an empty string.
+ALTER TABLE companies
+    ADD COLUMN IF NOT EXISTS quarterly_hash text
+        GENERATED ALWAYS AS (md5(
+            coalesce((data->'financials'->'quarterly'->'revenue')::text, '') || '|' ||
+            coalesce((data->'financials'->'quarterly'->'market_cap')::text, '') || '|' ||
+            coalesce((data->'financials'->'quarterly'->'roic')::text, '')
+        )) STORED;
@@ -0,0 +1,13 @@
+-- DTW distances from any reference symbol, replacing the single-reference distance2DEZ.
+--
+-- The similarity service of the FastAPI app (dtaidistance/similarity.py) writes the distances
+-- of every candidate each time it computes a reference; rows of a reference are replaced as a whole.
+-- The index serves "nearest symbols to X" ordered by distance.
+CREATE TABLE IF NOT EXISTS dtw_similarity (
+    ref_symbol TEXT NOT NULL,
+    symbol TEXT NOT NULL,
+    distance FLOAT,
+    PRIMARY KEY (ref_symbol, symbol)
+);
+
+CREATE INDEX IF NOT EXISTS dtw_similarity_ref_distance_idx ON dtw_similarity (ref_symbol, distance);
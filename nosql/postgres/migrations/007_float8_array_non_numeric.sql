@@ -0,0 +1,20 @@
+-- Non-numeric quarterly values in jsonb_to_float8_array.
+--
+-- The function from migration 003 cast every element to double precision, so a value
+-- like "N/A" failed the generated columns and rejected every write of that company.
+-- Elements that are not numbers now become NULL, like JSON null already did. Stored
+-- columns pick up the new definition the next time a row is written.
+CREATE OR REPLACE FUNCTION jsonb_to_float8_array(series jsonb)
+RETURNS double precision[]
+LANGUAGE sql
+IMMUTABLE
+AS $$
+    SELECT CASE
+        WHEN jsonb_typeof(series) = 'array' THEN ARRAY(
+            SELECT CASE WHEN jsonb_typeof(value) = 'number' THEN value::double precision END
+            FROM jsonb_array_elements(series) WITH ORDINALITY AS t(value, position)
+            ORDER BY position
+        )
+        ELSE '{}'::double precision[]
+    END
+$$;
@@ -0,0 +1,21 @@
+-- Non-numeric quarterly values in jsonb_tail_avg.
+--
+-- The function from migration 004 cast every element to double precision, so a value
+-- like "N/A" failed the generated columns and rejected every write of that company.
+-- Values that are not numbers now count as missing, so like a null they make the
+-- average NULL and the company never qualifies. Stored columns pick up the new
+-- definition the next time a row is written.
+CREATE OR REPLACE FUNCTION jsonb_tail_avg(series jsonb, n integer)
+RETURNS double precision
+LANGUAGE sql
+IMMUTABLE
+AS $$
+    SELECT CASE
+        WHEN jsonb_typeof(series) = 'array' THEN (
+            SELECT CASE WHEN count(number) = count(*) THEN avg(number) END
+            FROM jsonb_array_elements(series) WITH ORDINALITY AS t(value, position),
+                LATERAL (SELECT CASE WHEN jsonb_typeof(value) = 'number' THEN value::double precision END) AS v(number)
+            WHERE position > jsonb_array_length(series) - n
+        )
+    END
+$$;
@@ -0,0 +1,23 @@
+-- Non-numeric endpoints in trend_category.
+--
+-- The function from migration 001 cast the first and last values to double precision,
+-- so a value like "N/A" failed the stored category columns and rejected every write of
+-- that company. The category is now NULL (unknown) when either value is not a number.
+-- Stored columns pick up the new definition the next time a row is written.
+CREATE OR REPLACE FUNCTION trend_category(series jsonb)
+RETURNS text
+LANGUAGE sql
+IMMUTABLE
+AS $$
+    SELECT CASE
+        WHEN jsonb_typeof(series) IS DISTINCT FROM 'array' OR jsonb_array_length(series) < 2
+            THEN 'Cluster 2: Cyclical patterns'
+        WHEN jsonb_typeof(series->-1) IS DISTINCT FROM 'number' OR jsonb_typeof(series->0) IS DISTINCT FROM 'number'
+            THEN NULL
+        WHEN (series->-1)::double precision > (series->0)::double precision
+            THEN 'Cluster 1: Steady growth'
+        WHEN (series->-1)::double precision < (series->0)::double precision
+            THEN 'Cluster 3: Declining'
+        ELSE 'Cluster 2: Cyclical patterns'
+    END
+$$;
@@ -85,10 +85,10 @@ def insert_model_result(symbol: str, model: str):
 def get_stock_data(symbol: str, start_date: str, end_date: str, last_quarter_date: str = "2025-06-30") -> pd.DataFrame:
     query = """
     SELECT
-        data->>'qfs_symbol_v2' AS symbol,
-        COALESCE(data->'financials'->'quarterly'->'market_cap', '[]'::jsonb) AS market_cap
+        symbol,
+        market_cap
     FROM companies
-    WHERE data->>'qfs_symbol_v2' = %s;
+    WHERE symbol = %s;
     """
     params = (symbol,)
     df = fetch_data(query, params)
@@ -166,9 +166,9 @@ def find_best_model(symbol: str, data: pd.DataFrame):
 # Fetch all unique symbols from the companies table
 def get_all_symbols() -> list:
     query = """
-    SELECT DISTINCT data->>'qfs_symbol_v2' AS symbol
+    SELECT DISTINCT symbol
     FROM companies
-    WHERE data->>'qfs_symbol_v2' IS NOT NULL;
+    WHERE symbol IS NOT NULL;
     """
     df = fetch_data(query)
     return df['symbol'].tolist()